@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Admin, Attendance, Teacher
+from .models import Admin, Attendance, Teacher, TeacherImport, ClockEvent
 # Register your models here.
 
 
@@ -14,4 +14,14 @@ class TeacherAdmin(admin.ModelAdmin):
     list_display = ("first_name", "last_name", "email", "level")
 
 
+@admin.register(TeacherImport)
+class TeacherImportAdmin(admin.ModelAdmin):
+    list_display = ("file_name", "status", "total_rows", "created_count", "created_at")
+
+
+@admin.register(ClockEvent)
+class ClockEventAdmin(admin.ModelAdmin):
+    list_display = ("idempotency_key", "email", "clocked_at", "status")
+
+
 admin.site.register(Admin)
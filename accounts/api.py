@@ -1,27 +1,45 @@
-import csv
 from typing import List
 from asgiref.sync import sync_to_async
 
-from ninja import Router, File
+from ninja import Router, File, Query
 from ninja.files import UploadedFile
 from ninja.responses import codes_4xx
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from django.utils import timezone
 
-from accounts.models import PromotionDemotion, Teacher, Attendance
+from accounts.models import PromotionDemotion, Teacher, Attendance, TeacherImport
 from accounts.schemas import (
     TeacherSchema,
     AttendenceSchema,
     PromotionSchema,
     LoginSchema,
     TokenSchema,
-    DemotionSchema
+    DemotionSchema,
+    TeacherImportSchema,
+    TeacherListSchema,
+    TeacherPageSchema,
+    TeacherFilterSchema,
+    ClockEventBatchSchema,
+    ClockEventBatchResultSchema
 )
-from accounts.auth import JWTAuth
-from payments.models import Level, SalaryCycle
+from accounts.auth import JWTAuth, acheck_password
+from accounts.importers import TeacherImporter
+from accounts.loaders import teacher_by_id, teacher_by_email
+from accounts.tasks import import_teachers
+from accounts.helpers import (MIN_CLOCK_OUT_DELAY, TEACHERS_VERSION_KEY, clock_attendance_async, apply_clock_events_async,
+                             teacher_id_cache)
+from payments.cycles import salary_cycle_index
+from payments.levels import level_cache
 from base.schemas import Success, Error
+from base.pagination import KeysetParams, keyset_paginate_async
+from base.executors import orm_sync_to_async
+from base.conditional import conditional_get
+from base.responses import trusted_response
 from base.messages import ResponseMessages
+from tutorX.db_router import use_replica
 
 User = get_user_model()
 router = Router(tags=['Account'])
@@ -29,11 +47,11 @@ router = Router(tags=['Account'])
 
 @router.post("/login", response={200: TokenSchema, codes_4xx: Error}, auth=None)
 async def login(request, payload: LoginSchema):
-    user = await User.objects.filter(username=payload.email).afirst()
+    user = await orm_sync_to_async(User.objects.filter(username=payload.email).first)()
     if not user:
         return 400, {"error": ResponseMessages.WRONG_CREDENTIALS_MSG}
 
-    if not user.check_password(payload.password):
+    if not await acheck_password(user, payload.password):
         return 400, {"error": ResponseMessages.WRONG_CREDENTIALS_MSG}
 
     access, refresh = JWTAuth(user).generate_token_pair()
@@ -63,7 +81,7 @@ def refresh_token(request, token: str):
 async def onboard_teachers(request, payload: TeacherSchema):
     """ Teachers onboarding by an admin"""
     # check if level exist
-    if not await Level.active_objects.filter(id=payload.level_id).aexists():
+    if not await level_cache.aget(payload.level_id):
         return 400, {"error": ResponseMessages.LEVEL_NOT_FOUND}
 
     if await Teacher.objects.filter(account_number=payload.account_number).aexists():
@@ -74,27 +92,33 @@ async def onboard_teachers(request, payload: TeacherSchema):
 
 
 @router.get("/teachers/{id}", response={200: TeacherSchema, codes_4xx: Error})
+@conditional_get(TEACHERS_VERSION_KEY)
+@use_replica
 async def get_teacher(request, id: int):
     """ get a single teacher obj"""
-    teacher = await Teacher.active_objects.filter(pk=id).afirst()
+    teacher = await teacher_by_id.load(id)
     if not teacher:
         return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
     return teacher
 
 
-@router.get("/teachers", response={200: List[TeacherSchema], codes_4xx: Error})
-async def get_all_teachers(request):
-    return await sync_to_async(list)(Teacher.active_objects.all())
+@router.get("/teachers", response={200: TeacherPageSchema, codes_4xx: Error}, exclude_unset=True)
+@conditional_get(TEACHERS_VERSION_KEY)
+@use_replica
+async def get_all_teachers(request, filters: TeacherFilterSchema = Query(...), params: KeysetParams = Query(...)):
+    """ teachers a page at a time. use next_cursor to get the next page """
+    qs = filters.filter(Teacher.active_objects.all())
+    return trusted_response(request, await keyset_paginate_async(qs, params, TeacherListSchema.model_fields))
 
 
 @router.patch("/teachers/{id}/update", response={200: TeacherSchema, codes_4xx: Error})
 async def update_teachers(request, id: int, data: TeacherSchema):
     """ Update teachers credentials """
-    teacher = await Teacher.active_objects.filter(pk=id).afirst()
+    teacher = await teacher_by_id.load(id)
     if not teacher:
         return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
     payload = data.dict(exclude_unset=True)
-    if payload.level_id and not await Level.active_objects.filter(id=payload.level_id).aexists():
+    if payload.get("level_id") and not await level_cache.aget(payload["level_id"]):
         return 400, {"error": ResponseMessages.LEVEL_NOT_FOUND}
 
     field_names = []
@@ -108,86 +132,113 @@ async def update_teachers(request, id: int, data: TeacherSchema):
 
 @router.delete("/teachers/{id}/delete", response={200: Success, codes_4xx: Error})
 async def delete_teacher(request, id: int):
-    teacher = await Teacher.active_objects.filter(pk=id).afirst()
-    if not teacher:
+    """ soft delete a teacher with their attendance, promotions and work hours. purge_deleted removes them later """
+    if not await Teacher.active_objects.filter(pk=id).asoft_delete():
         return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
 
-    await teacher.adelete()
     return 200, {"message": "Teacher deleted successfully"}
 
 
-@router.post("/import/teachers", response={200: Success, codes_4xx: Error})
+@router.post("/import/teachers", response={200: TeacherImportSchema, 202: TeacherImportSchema, codes_4xx: Error})
 async def bulk_upload_teachers(request, file: UploadedFile = File(...)):
+    """ import teachers from a csv. large files are imported in the background """
     if not file.name.endswith('csv'):
         return 400, {"error": ResponseMessages.INVALID_FILE_FORMAT}
-    reader = csv.reader(file)
-    headers = next(reader, None)
-    expected_headers = ["first_name", "last_name", "email",
-                        "level_id", "account_number", "bank", "account_name"]
-    print(headers)
-    if headers != expected_headers:
-        return 400, {"error": "Invalid CSV file. Headers do not match. Expected headers: {}'.format(', '.join(expected_headers)"}
-
-    errors = []
-    for row in reader:
-        # check if level_id exists
-        try:
-            level = await Level.active_objects.get(id=row[3])
-        except Level.DoesNotExist:
-            # append error
-            errors.append(f'Level with {row[3]} does not exist')
-            continue
-        teachers, _ = await Teacher.active_objects.aget_or_create(first_name=row[0], last_name=row[1], email=row[2], level=level,
-                                                                  account_number=row[4], bank=row[5], account_name=[6])
-        return 200, {"message": "Teacher created successfully"}
+
+    if file.size > settings.TEACHER_IMPORT_ASYNC_THRESHOLD:
+        file_path = await sync_to_async(default_storage.save)(f"imports/teachers/{file.name}", file)
+        teacher_import = await TeacherImport.objects.acreate(file_name=file.name, file_path=file_path)
+        await sync_to_async(import_teachers.delay)(teacher_import.id)
+        return 202, teacher_import
+
+    teacher_import = await TeacherImport.objects.acreate(file_name=file.name)
+    await orm_sync_to_async(TeacherImporter(teacher_import).run)(file.chunks())
+    return 200, teacher_import
+
+
+@router.get("/import/teachers/{id}", response={200: TeacherImportSchema, codes_4xx: Error})
+async def get_teacher_import(request, id: int):
+    """ status and error report of a teachers import """
+    teacher_import = await TeacherImport.active_objects.filter(pk=id).afirst()
+    if not teacher_import:
+        return 400, {"error": ResponseMessages.IMPORT_NOT_FOUND}
+    return teacher_import
+
+
+async def get_teacher_id(email):
+    """ id of the active teacher with the email, cached per worker """
+    teacher_id = teacher_id_cache.get(email)
+    if teacher_id is None:
+        # misses of concurrent clock-ins share one query
+        teacher = await teacher_by_email.load(email)
+        if teacher is not None:
+            teacher_id = teacher.id
+            teacher_id_cache.set(email, teacher_id)
+    return teacher_id
 
 
 @router.post('/attendance', response={200: Success, codes_4xx: Error}, auth=None)
 async def register_attendance(request, payload: AttendenceSchema):
     """ endpoint to take attendance. clock in and clock out  """
-    teacher = await Teacher.active_objects.filter(email=payload.email).afirst()
-    if not teacher:
+    teacher_id = await get_teacher_id(payload.email)
+    if teacher_id is None:
         return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
 
-    # check if today's attendence exists
     dt = timezone.now()
-    qs = Attendance.active_objects.filter(teacher=teacher, date=dt.date())
+    attendance_obj = await clock_attendance_async(teacher_id, payload.email, dt)
+    if attendance_obj is None:
+        # nothing was written, find out why
+        attendance_obj = await Attendance.active_objects.filter(teacher_id=teacher_id, teacher__email=payload.email,
+                                                                teacher__is_deleted=False, date=dt.date()).afirst()
+        if not attendance_obj:
+            # the cached teacher changed email or was deleted
+            teacher_id_cache.delete(payload.email)
+            return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
+
+        # can only clock out atleast one hour after clock in
+        if not dt > attendance_obj.clock_in + MIN_CLOCK_OUT_DELAY:
+            return 400, {"error": ResponseMessages.DUPLICATE_CLOCK_IN}
+        return 400, {"error": ResponseMessages.DUPLICATE_CLOCK_OUT}
 
-    if not await qs.aexists():
-        await Attendance.active_objects.acreate(date=dt.date(), teacher=teacher, clock_in=dt)
+    if attendance_obj.clock_out is None:
         return 200, {"message": f"Clock in at {dt.strftime('%H:%M:%S')} successful"}
+    return 200, {"message": f"Clock out at {dt.strftime('%H:%M:%S')} successful"}
 
-    # can only clock out atleast one hour after clock in
-    attendance_obj = await qs.afirst()
-    if not dt > attendance_obj.clock_in + timezone.timedelta(hours=1):
-        return 400, {"error": ResponseMessages.DUPLICATE_CLOCK_IN}
-
-    if attendance_obj.clock_out is not None:
-        return 400, {"error": ResponseMessages.DUPLICATE_CLOCK_OUT}
 
-    await qs.aupdate(clock_out=dt)
-    return 200, {"message": f"Clock out at {dt.strftime('%H:%M:%S')} successful"}
+@router.post('/attendance/batch', response={200: ClockEventBatchResultSchema}, auth=None)
+async def register_attendance_batch(request, payload: ClockEventBatchSchema):
+    """ clock events buffered by a device, applied at the time they were taken.
+    events are identified by their idempotency_key, so a batch can be sent again safely """
+    return {"results": await apply_clock_events_async(payload.events)}
 
 
 # promotion and demotion
 
 @router.post('/promotion', response={200: Success, codes_4xx: Error}, auth=None)
 async def promote_teacher(request, payload: PromotionSchema):
-    teacher = await Teacher.active_objects.filter(email=payload.email).afirst()
+    # awaited in the request task, the loader memo and the routing of the request belong to it
+    teacher = await teacher_by_email.load(payload.email)
+    level = await level_cache.aget(payload.level_id)
+    salary_cycle = await salary_cycle_index.aget_by_id(payload.salary_cycle_id)
     if not teacher:
         return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
 
-    level = await Level.active_objects.filter(id=payload.level_id).afirst()
     if not level:
         return 400, {"error": ResponseMessages.LEVEL_NOT_FOUND}
 
-    if not await SalaryCycle.active_objects.filter(id=payload.salary_cycle_id).afirst():
+    if not salary_cycle:
         return 400, {"error": ResponseMessages.SALARY_CYCLE_NOT_FOUND}
 
-    if payload.level_id == level.id:
+    if teacher.level_id == level.id:
         return 400, {"error": ResponseMessages.EXISTING_LEVEL}
 
-    await PromotionDemotion.objects.acreate(teacher=teacher, level=level, is_promoted=payload.is_promoted, salary_cycle_id=payload.salary_cycle_id)
+    # today, or the nearest day of the cycle when it is not the current one
+    effective_date = payload.effective_date or min(max(timezone.localdate(), salary_cycle.start_date), salary_cycle.end_date)
+    if not salary_cycle.start_date <= effective_date <= salary_cycle.end_date:
+        return 400, {"error": ResponseMessages.EFFECTIVE_DATE_OUTSIDE_SALARY_CYCLE}
+
+    await PromotionDemotion.objects.acreate(teacher=teacher, level=level, previous_level_id=teacher.level_id, is_promoted=payload.is_promoted,
+                                            salary_cycle_id=payload.salary_cycle_id, effective_date=effective_date)
 
     teacher.level = level
     await teacher.asave(update_fields=["level"])
@@ -196,23 +247,29 @@ async def promote_teacher(request, payload: PromotionSchema):
 
 @router.post('/demotion', response={200: Success, codes_4xx: Error})
 async def demoted_teacher(request, payload: DemotionSchema):
-    teacher = await Teacher.active_objects.filter(email=payload.email).afirst()
+    teacher = await teacher_by_email.load(payload.email)
+    level = await level_cache.aget(payload.level_id)
+    salary_cycle = await salary_cycle_index.aget_by_id(payload.salary_cycle_id)
     if not teacher:
         return 400, {"error": ResponseMessages.TEACHER_NOT_FOUND}
 
-    level = await Level.active_objects.filter(id=payload.level_id).afirst()
     if not level:
         return 400, {"error": ResponseMessages.LEVEL_NOT_FOUND}
 
-    if not await SalaryCycle.active_objects.filter(id=payload.salary_cycle_id).afirst():
+    if not salary_cycle:
         return 400, {"error": ResponseMessages.SALARY_CYCLE_NOT_FOUND}
 
-    if payload.level_id == level.id:
+    if teacher.level_id == level.id:
         return 400, {"error": ResponseMessages.EXISTING_LEVEL}
 
-    await PromotionDemotion.objects.acreate(teacher=teacher, level=level, is_demoted=payload.is_demoted, salary_cycle_id=payload.salary_cycle_id)
+    effective_date = payload.effective_date or min(max(timezone.localdate(), salary_cycle.start_date), salary_cycle.end_date)
+    if not salary_cycle.start_date <= effective_date <= salary_cycle.end_date:
+        return 400, {"error": ResponseMessages.EFFECTIVE_DATE_OUTSIDE_SALARY_CYCLE}
+
+    await PromotionDemotion.objects.acreate(teacher=teacher, level=level, previous_level_id=teacher.level_id, is_demoted=payload.is_demoted,
+                                            salary_cycle_id=payload.salary_cycle_id, effective_date=effective_date)
 
     teacher.level = level
-    teacher.save(update_fields=["level"])
+    await teacher.asave(update_fields=["level"])
 
     return {"message": f"{teacher.full_name} has been demoted to {level.name}"}
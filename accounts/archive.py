@@ -0,0 +1,248 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import Attendance, Teacher
+
+MAGIC = b"TXATT01\n"
+_HEADER_LENGTH = struct.Struct("<I")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# clock_out of attendance never clocked out
+NULL_TIME = -2 ** 63
+
+# (column, array typecode), in the order of the row tuples read from the table
+COLUMNS = [("id", "q"), ("teacher_id", "q"), ("date", "i"), ("clock_in", "q"), ("clock_out", "q"),
+           ("present", "B"), ("is_deleted", "B"), ("created_at", "q"), ("updated_at", "q")]
+DATE_COLUMNS = {"date"}
+TIME_COLUMNS = {"clock_in", "clock_out", "created_at", "updated_at"}
+
+
+def _encode(column, value):
+    if column in TIME_COLUMNS:
+        return NULL_TIME if value is None else (value - EPOCH) // timedelta(microseconds=1)
+    if column in DATE_COLUMNS:
+        return value.toordinal() - EPOCH_ORDINAL
+    return int(value)
+
+
+def _decode(column, value):
+    if column in TIME_COLUMNS:
+        return None if value == NULL_TIME else EPOCH + timedelta(microseconds=value)
+    if column in DATE_COLUMNS:
+        return date.fromordinal(value + EPOCH_ORDINAL)
+    if column in ("present", "is_deleted"):
+        return bool(value)
+    return value
+
+
+class ArchivedAttendance:
+    """
+    Reader of an archived salary cycle. The file is memory-mapped and a column is only
+    decompressed when it is read, so a report touching two columns never inflates the others.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an attendance archive")
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        (length,) = _HEADER_LENGTH.unpack_from(self._map, len(MAGIC))
+        self.header = json.loads(self._map[start:start + length])
+        self._data_start = start + length
+        self._columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def column(self, name):
+        """ raw values of a column: day numbers for dates, microseconds since the epoch for times """
+        if name not in self._columns:
+            meta = self.header["columns"][name]
+            values = array(meta["type"])
+            offset = self._data_start + meta["offset"]
+            values.frombytes(zlib.decompress(self._map[offset:offset + meta["size"]]))
+            if sys.byteorder == "big":
+                values.byteswap()
+            self._columns[name] = values
+        return self._columns[name]
+
+    def rows(self, columns=None):
+        """ rows as dicts of python values, of the given columns only if any """
+        columns = columns or [name for name, _ in COLUMNS]
+        values = [self.column(name) for name in columns]
+        for row in zip(*values):
+            yield {name: _decode(name, value) for name, value in zip(columns, row)}
+
+    def work_seconds(self):
+        """ seconds worked by each teacher, the way compute_work_seconds counts them from the table """
+        worked = defaultdict(int)
+        columns = zip(self.column("teacher_id"), self.column("clock_in"), self.column("clock_out"), self.column("is_deleted"))
+        for teacher_id, clock_in, clock_out, is_deleted in columns:
+            if not is_deleted and clock_out != NULL_TIME:
+                worked[teacher_id] += (clock_out - clock_in) // 1_000_000
+        return dict(worked)
+
+
+class AttendanceArchive:
+    """
+    Attendance of archived salary cycles, one file per cycle at <root>/<salary cycle id>.att:
+    the magic bytes, the length of a json header, the header, then each column as a zlib block
+    of little-endian values. The header gives the cycle, the row count and where each column lies
+    after it.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        return Path(self._root or settings.ATTENDANCE_ARCHIVE_DIR)
+
+    def path(self, salary_cycle_id):
+        return self.root / f"{salary_cycle_id}.att"
+
+    def exists(self, salary_cycle_id):
+        return self.path(salary_cycle_id).exists()
+
+    def open(self, salary_cycle_id):
+        """ reader of an archived cycle, None when it is not archived """
+        try:
+            return ArchivedAttendance(self.path(salary_cycle_id))
+        except FileNotFoundError:
+            return None
+
+    def write(self, salary_cycle, columns):
+        """ store the columns of a cycle, replacing its previous archive """
+        rows = len(columns["id"])
+        blocks, offset = [], 0
+        header = {"salary_cycle_id": salary_cycle.id, "start_date": salary_cycle.start_date.isoformat(),
+                  "end_date": salary_cycle.end_date.isoformat(), "rows": rows,
+                  "archived_at": timezone.now().isoformat(), "columns": {}}
+        for name, typecode in COLUMNS:
+            values = columns[name]
+            if sys.byteorder == "big":
+                values = array(typecode, values)
+                values.byteswap()
+            block = zlib.compress(values.tobytes(), settings.ATTENDANCE_ARCHIVE_COMPRESSION)
+            header["columns"][name] = {"type": typecode, "offset": offset, "size": len(block)}
+            blocks.append(block)
+            offset += len(block)
+        encoded = json.dumps(header).encode()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(salary_cycle.id)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(MAGIC)
+                tmp.write(_HEADER_LENGTH.pack(len(encoded)))
+                tmp.write(encoded)
+                for block in blocks:
+                    tmp.write(block)
+                tmp.flush()
+                # the rows are deleted from the table once this returns
+                os.fsync(tmp.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return path
+
+    def delete(self, salary_cycle_id):
+        self.path(salary_cycle_id).unlink(missing_ok=True)
+
+
+attendance_archive = AttendanceArchive()
+
+
+def archive_salary_cycle(salary_cycle, batch_size):
+    """
+    move the attendance dated within a salary cycle, soft-deleted rows included, from the table
+    to its archive. rows already archived by an earlier run are kept. returns the rows moved
+    """
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    archived = attendance_archive.open(salary_cycle.id)
+    if archived is not None:
+        with archived:
+            for name, _ in COLUMNS:
+                columns[name].extend(archived.column(name))
+    archived_ids = set(columns["id"])
+
+    fields = [name for name, _ in COLUMNS]
+    attendance = Attendance.objects.filter(date__range=(salary_cycle.start_date, salary_cycle.end_date))
+    moved = []
+    for row in attendance.order_by("teacher_id", "date", "id").values_list(*fields).iterator(chunk_size=batch_size):
+        if row[0] in archived_ids:
+            moved.append(row[0])
+            continue
+        for name, value in zip(fields, row):
+            columns[name].append(_encode(name, value))
+        moved.append(row[0])
+    if not moved:
+        return 0
+
+    attendance_archive.write(salary_cycle, columns)
+    for start in range(0, len(moved), batch_size):
+        with transaction.atomic():
+            Attendance.objects.filter(id__in=moved[start:start + batch_size]).delete()
+    return len(moved)
+
+
+RESTORE_ATTENDANCE_SQL = """
+INSERT INTO {attendance} (id, teacher_id, date, clock_in, clock_out, present, is_deleted, created_at, updated_at)
+SELECT archived.* FROM unnest(%s::bigint[], %s::bigint[], %s::date[], %s::timestamptz[], %s::timestamptz[],
+                              %s::boolean[], %s::boolean[], %s::timestamptz[], %s::timestamptz[])
+    AS archived(id, teacher_id, date, clock_in, clock_out, present, is_deleted, created_at, updated_at)
+WHERE EXISTS (SELECT 1 FROM {teacher} teacher WHERE teacher.id = archived.teacher_id)
+ON CONFLICT DO NOTHING
+""".format(attendance=Attendance._meta.db_table, teacher=Teacher._meta.db_table)
+
+
+def restore_salary_cycle(salary_cycle_id, batch_size):
+    """
+    insert the archived attendance of a salary cycle back into the table and remove its archive.
+    rows of deleted teachers, or clashing with rows written since, are skipped.
+    returns (rows archived, rows restored), None when the cycle is not archived
+    """
+    archived = attendance_archive.open(salary_cycle_id)
+    if archived is None:
+        return None
+    restored = 0
+    with archived, transaction.atomic(), connection.cursor() as cursor:
+        rows = archived.rows()
+        while batch := [tuple(row.values()) for row in islice(rows, batch_size)]:
+            cursor.execute(RESTORE_ATTENDANCE_SQL, [list(column) for column in zip(*batch)])
+            restored += cursor.rowcount
+        transaction.on_commit(lambda: attendance_archive.delete(salary_cycle_id))
+    return len(archived), restored
@@ -1,3 +1,5 @@
+import copy
+import time
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidSignatureError, DecodeError
 from datetime import timedelta
@@ -9,6 +11,8 @@ from django.contrib.auth import get_user_model
 
 from accounts.models import User
 from accounts.exceptions import InvalidToken, ExpiredTokenError, EmptyAuthorizationHeader
+from base.cache import LRUCache, aget_version, bump_version
+from base.executors import BoundedExecutor, orm_sync_to_async
 from base.constants import (
     ACCESS_TOKEN_LIFETIME,
     HASH_ALG,
@@ -27,6 +31,66 @@ User = get_user_model()
 #         return TokenAuthentication(request, key).authenticate()
 
 
+class TokenCache:
+    """
+    Verified token -> user, kept until the token expires or at most TOKEN_CACHE_TTL seconds.
+    A token is kept with the version its user had when it was verified. invalidate() bumps the version,
+    shared by every worker through the django cache, which drops every token of the user,
+    e.g. after a password change or deactivation. The version of a user is read again at most every
+    check_interval seconds, so other workers drop the tokens within check_interval seconds.
+    """
+
+    def __init__(self, maxsize, ttl, check_interval):
+        self.ttl = ttl
+        self._tokens = LRUCache(maxsize=maxsize)
+        self._versions = LRUCache(maxsize=maxsize, ttl=check_interval)
+
+    @staticmethod
+    def version_key(user_id):
+        return f"user:{user_id}:tokens:version"
+
+    async def aversion(self, user_id):
+        return await aget_version(self.version_key(user_id))
+
+    async def aget(self, token):
+        """ a copy of the user of the token, requests may change it """
+        item = self._tokens.get(token)
+        if item is None:
+            return None
+        user, version = item
+        current = self._versions.get(user.pk)
+        if current is None:
+            current = await self.aversion(user.pk)
+            self._versions.set(user.pk, current)
+        if version != current:
+            self._tokens.delete(token)
+            return None
+        return copy.copy(user)
+
+    def set(self, token, user, version, expires_at):
+        """ version is the one read before the user was, a change in between invalidates the token """
+        ttl = min(self.ttl, expires_at - time.time())
+        if ttl > 0:
+            self._tokens.set(token, (copy.copy(user), version), ttl=ttl)
+
+    def invalidate(self, user_id):
+        bump_version(self.version_key(user_id))
+        # dropped right away in this worker
+        self._versions.delete(user_id)
+
+
+token_cache = TokenCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL,
+                         check_interval=settings.TOKEN_CACHE_CHECK_INTERVAL)
+
+# password hashing is cpu bound, it runs off the event loop on a few dedicated threads
+password_hasher = BoundedExecutor("password-hasher", max_workers=settings.PASSWORD_HASHER_WORKERS,
+                                  max_queue=settings.PASSWORD_HASHER_MAX_QUEUE)
+
+
+async def acheck_password(user, raw_password):
+    return await password_hasher.run(user.check_password, raw_password)
+
+
 async def async_auth_bearer(request):
     token = get_auth_header(request)
     return await TokenAuthentication(request, token).authenticate()
@@ -48,21 +112,25 @@ class TokenAuthentication:
     #     return user
 
     async def authenticate(self):
-        email = self._get_user_email_from_token()
-
-        user = await get_user(email)
+        user = await token_cache.aget(self.token)
+        if user:
+            return user
 
-        if not user:
+        payload = JWTAuth().decode_token(self.token)
+        if not payload.get("user"):
             raise InvalidToken
 
-        return user
+        # tokens issued before the id claim are not cached, their version can not be read before the user
+        user_id = payload["user"].get("id")
+        version = await token_cache.aversion(user_id) if user_id is not None else None
+        user = await get_user(**payload["user"])
 
-    def _get_user_email_from_token(self):
-        payload = JWTAuth().decode_token(self.token)
-        if not payload.get("user"):
+        if not user:
             raise InvalidToken
 
-        return payload["user"].get("email")
+        if version is not None:
+            token_cache.set(self.token, user, version, payload["exp"])
+        return user
 
 
 def get_auth_header(request):
@@ -82,8 +150,11 @@ def get_auth_header(request):
 #     return User.objects.filter(email=email).first()
 
 
-async def get_user(email):
-    return await User.objects.filter(username=email).afirst()
+async def get_user(email=None, id=None):
+    # tokens issued before the id claim only carry the email
+    if id is not None:
+        return await orm_sync_to_async(User.objects.filter(pk=id, is_active=True).first)()
+    return await orm_sync_to_async(User.objects.filter(username=email, is_active=True).first)()
 
 
 class JWTAuth:
@@ -99,6 +170,7 @@ class JWTAuth:
             "iat": timezone.now(),
             "exp": timezone.now() + settings.JWT[ACCESS_TOKEN_LIFETIME],
             "user": {
+                "id": self.user.pk,
                 "email": self.user.username,
             },
         }
@@ -1,21 +1,211 @@
-from asgiref.sync import sync_to_async
+from datetime import timedelta, timezone as dt_timezone
 
-from .models import Attendance, Teacher
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum, DurationField, ExpressionWrapper
+from django.db.models.functions import Extract, Floor
+from django.utils import timezone
+
+from .models import Attendance, Teacher, WorkHourLedger, ClockEvent, ClockEventStatus
 from payments.models import SalaryCycle
+from payments.cycles import salary_cycle_index
+from base.cache import LRUCache, bump_version
+from base.executors import orm_sync_to_async
+from base.messages import ResponseMessages
+
+# can only clock out atleast one hour after clock in
+MIN_CLOCK_OUT_DELAY = timedelta(hours=1)
+
+TEACHERS_VERSION_KEY = "teachers:version"
+
+
+def invalidate_teachers():
+    """ call after changing teachers without save(), e.g. bulk_create or update() """
+    bump_version(TEACHERS_VERSION_KEY)
+
+
+# email -> teacher id of the teachers taking attendance. the clock statement checks the email again,
+# so a stale entry never clocks in the wrong teacher
+teacher_id_cache = LRUCache(maxsize=settings.TEACHER_ID_CACHE_SIZE)
 
 def get_attendence(**kwargs):
     return Attendance.active_objects.filter(**kwargs)
 
-get_attendence_async = sync_to_async(get_attendence)
+get_attendence_async = orm_sync_to_async(get_attendence)
 
 def get_teacher(**kwargs):
     return Teacher.active_objects.filter(**kwargs)
 
-get_teacher_async = sync_to_async(get_teacher)
+get_teacher_async = orm_sync_to_async(get_teacher)
 
 
 def get_salary_cycle(**kwargs):
     return SalaryCycle.active_objects.filter(**kwargs)
 
 
-get_salary_cycle_async = sync_to_async(get_salary_cycle)
+get_salary_cycle_async = orm_sync_to_async(get_salary_cycle)
+
+
+def get_worked_seconds(clock_in, clock_out):
+    """ whole seconds between clock in and clock out, the same way compute_work_seconds sums them """
+    return (clock_out - clock_in) // timedelta(seconds=1)
+
+
+def compute_work_seconds(salary_cycle):
+    """ full recompute of the seconds worked by each teacher within a salary cycle from attendance """
+    worked = ExpressionWrapper(F("clock_out") - F("clock_in"), output_field=DurationField())
+    return Attendance.active_objects.filter(clock_out__isnull=False,
+                                            date__range=(salary_cycle.start_date, salary_cycle.end_date)
+                                            ).values("teacher_id").annotate(worked_seconds=Sum(Floor(Extract(worked, "epoch"))))
+
+
+CLOCK_ATTENDANCE_SQL = """
+WITH attendance AS (
+    INSERT INTO {attendance} (created_at, updated_at, is_deleted, date, clock_in, clock_out, present, teacher_id)
+    SELECT %(now)s, %(now)s, false, %(date)s, %(now)s, NULL, true, teacher.id
+    FROM {teacher} teacher
+    WHERE teacher.id = %(teacher_id)s AND teacher.email = %(email)s AND NOT teacher.is_deleted
+    ON CONFLICT (teacher_id, date) WHERE NOT is_deleted
+    DO UPDATE SET clock_out = EXCLUDED.clock_in, updated_at = EXCLUDED.updated_at
+    WHERE {attendance}.clock_out IS NULL AND EXCLUDED.clock_in > {attendance}.clock_in + %(min_clock_out_delay)s
+    RETURNING teacher_id, date, clock_in, clock_out
+), ledger AS (
+    INSERT INTO {ledger} (created_at, updated_at, is_deleted, teacher_id, salary_cycle_id, worked_seconds)
+    SELECT %(now)s, %(now)s, false, attendance.teacher_id, salary_cycle.id,
+           FLOOR(EXTRACT(EPOCH FROM attendance.clock_out - attendance.clock_in))
+    FROM attendance
+    JOIN {salary_cycle} salary_cycle ON attendance.date BETWEEN salary_cycle.start_date AND salary_cycle.end_date
+    WHERE attendance.clock_out IS NOT NULL AND NOT salary_cycle.is_deleted
+    ON CONFLICT (teacher_id, salary_cycle_id)
+    DO UPDATE SET worked_seconds = {ledger}.worked_seconds + EXCLUDED.worked_seconds, updated_at = EXCLUDED.updated_at
+)
+SELECT date, clock_in, clock_out FROM attendance
+""".format(attendance=Attendance._meta.db_table, teacher=Teacher._meta.db_table,
+           ledger=WorkHourLedger._meta.db_table, salary_cycle=SalaryCycle._meta.db_table)
+
+
+def clock_attendance(teacher_id, email, now):
+    """
+    Clock the teacher in, or out if already clocked in for the day, in a single statement.
+    Clock-out also adds the worked seconds to the work hour ledger.
+    Returns the attendance, or None if nothing was written: the teacher is already clocked in (or out),
+    or the teacher no longer has that email.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(CLOCK_ATTENDANCE_SQL, {"now": now, "date": now.date(), "teacher_id": teacher_id,
+                                              "email": email, "min_clock_out_delay": MIN_CLOCK_OUT_DELAY})
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    date, clock_in, clock_out = row
+    return Attendance(teacher_id=teacher_id, date=date, clock_in=clock_in, clock_out=clock_out)
+
+
+clock_attendance_async = orm_sync_to_async(clock_attendance)
+
+
+def apply_clock_events(events):
+    """
+    Apply a batch of device clock events with the rules of clock_attendance, using the device time.
+    Events are applied in time order, in one transaction and a fixed number of queries.
+    An event whose idempotency key was seen before gets its recorded result again.
+    Returns a result per event, in the order of the events.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return _apply_clock_events(events)
+        except IntegrityError:
+            # a concurrent request inserted the same attendance, ledger or key, its rows are visible now
+            if attempt:
+                raise
+
+
+def _apply_clock_events(events):
+    keys = {event.idempotency_key for event in events}
+    recorded = {clock_event.idempotency_key: clock_event for clock_event in ClockEvent.objects.filter(idempotency_key__in=keys)}
+    teacher_ids = dict(Teacher.active_objects.filter(email__in={event.email for event in events}).values_list("email", "id"))
+
+    new_events = {}
+    for event in events:
+        if event.idempotency_key not in recorded and event.idempotency_key not in new_events:
+            clocked_at = event.clocked_at
+            if timezone.is_naive(clocked_at):
+                clocked_at = timezone.make_aware(clocked_at)
+            new_events[event.idempotency_key] = ClockEvent(idempotency_key=event.idempotency_key, email=event.email,
+                                                           teacher_id=teacher_ids.get(event.email), clocked_at=clocked_at)
+
+    pending = sorted((clock_event for clock_event in new_events.values() if clock_event.teacher_id),
+                     key=lambda clock_event: clock_event.clocked_at)
+    dates = {clock_event.clocked_at.astimezone(dt_timezone.utc).date() for clock_event in pending}
+    attendances = {(attendance.teacher_id, attendance.date): attendance
+                   for attendance in Attendance.active_objects.select_for_update().filter(
+                       teacher_id__in={clock_event.teacher_id for clock_event in pending}, date__in=dates)}
+
+    latest_time = timezone.now() + timedelta(seconds=settings.ATTENDANCE_MAX_CLOCK_SKEW)
+    created, updated, worked = {}, {}, {}
+    for clock_event in new_events.values():
+        if clock_event.teacher_id is None:
+            clock_event.status, clock_event.message = ClockEventStatus.TEACHER_NOT_FOUND, ResponseMessages.TEACHER_NOT_FOUND
+        elif clock_event.clocked_at > latest_time:
+            clock_event.status, clock_event.message = ClockEventStatus.INVALID_TIME, ResponseMessages.INVALID_CLOCK_TIME
+    for clock_event in pending:
+        if clock_event.status:
+            continue
+        clocked_at = clock_event.clocked_at
+        key = (clock_event.teacher_id, clocked_at.astimezone(dt_timezone.utc).date())
+        attendance = attendances.get(key)
+        if attendance is None:
+            attendances[key] = created[key] = Attendance(teacher_id=key[0], date=key[1], clock_in=clocked_at, present=True)
+            clock_event.status, clock_event.message = ClockEventStatus.CLOCKED_IN, f"Clock in at {clocked_at:%H:%M:%S} successful"
+        elif attendance.clock_out is not None:
+            clock_event.status, clock_event.message = ClockEventStatus.DUPLICATE_CLOCK_OUT, ResponseMessages.DUPLICATE_CLOCK_OUT
+        elif not clocked_at > attendance.clock_in + MIN_CLOCK_OUT_DELAY:
+            clock_event.status, clock_event.message = ClockEventStatus.DUPLICATE_CLOCK_IN, ResponseMessages.DUPLICATE_CLOCK_IN
+        else:
+            attendance.clock_out = clocked_at
+            if key not in created:
+                updated[key] = attendance
+            # like CLOCK_ATTENDANCE_SQL and compute_work_seconds, overlapping cycles are each credited
+            for salary_cycle in salary_cycle_index.get_all(key[1]):
+                ledger_key = (key[0], salary_cycle.id)
+                worked[ledger_key] = worked.get(ledger_key, 0) + get_worked_seconds(attendance.clock_in, clocked_at)
+            clock_event.status, clock_event.message = ClockEventStatus.CLOCKED_OUT, f"Clock out at {clocked_at:%H:%M:%S} successful"
+
+    now = timezone.now()
+    Attendance.objects.bulk_create(created.values())
+    for attendance in updated.values():
+        attendance.updated_at = now
+    Attendance.objects.bulk_update(updated.values(), ["clock_out", "updated_at"])
+    _add_work_seconds(worked, now)
+    ClockEvent.objects.bulk_create(new_events.values())
+
+    results, seen = [], set()
+    for event in events:
+        clock_event = recorded.get(event.idempotency_key) or new_events[event.idempotency_key]
+        replayed = event.idempotency_key in recorded or event.idempotency_key in seen
+        seen.add(event.idempotency_key)
+        results.append({"idempotency_key": event.idempotency_key, "status": clock_event.status,
+                        "message": clock_event.message, "replayed": replayed})
+    return results
+
+
+def _add_work_seconds(worked, now):
+    """ add seconds to the ledgers of (teacher id, salary cycle id) pairs with one read and two writes """
+    if not worked:
+        return
+    ledgers = WorkHourLedger.objects.select_for_update().filter(teacher_id__in={teacher_id for teacher_id, _ in worked},
+                                                               salary_cycle_id__in={cycle_id for _, cycle_id in worked})
+    existing = []
+    for ledger in ledgers:
+        seconds = worked.pop((ledger.teacher_id, ledger.salary_cycle_id), None)
+        if seconds is not None:
+            ledger.worked_seconds += seconds
+            ledger.updated_at = now
+            existing.append(ledger)
+    WorkHourLedger.objects.bulk_update(existing, ["worked_seconds", "updated_at"])
+    WorkHourLedger.objects.bulk_create(WorkHourLedger(teacher_id=teacher_id, salary_cycle_id=cycle_id, worked_seconds=seconds)
+                                       for (teacher_id, cycle_id), seconds in worked.items())
+
+
+apply_clock_events_async = orm_sync_to_async(apply_clock_events)
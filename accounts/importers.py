@@ -0,0 +1,119 @@
+import codecs
+import csv
+
+from django.conf import settings
+from django.db import transaction, DatabaseError
+from django.utils import timezone
+
+from accounts.helpers import invalidate_teachers
+from accounts.models import Teacher, TeacherImport, ImportStatus
+from payments.levels import level_cache
+
+
+EXPECTED_HEADERS = ["first_name", "last_name", "email",
+                    "level_id", "account_number", "bank", "account_name"]
+
+
+def iter_lines(chunks, encoding="utf-8-sig"):
+    """ decode byte chunks of an upload into lines without reading the whole file """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        # the last line may continue in the next chunk, a trailing \r may be the first half of a \r\n
+        pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+class TeacherImporter:
+    """
+    Streams a teachers csv into the database.
+    Levels, emails and account numbers are loaded once and rows are checked against them in memory,
+    valid rows are written with bulk_create, one transaction per batch.
+    """
+
+    def __init__(self, teacher_import, batch_size=None):
+        self.teacher_import = teacher_import
+        self.batch_size = batch_size or settings.TEACHER_IMPORT_BATCH_SIZE
+        self.errors = []
+        self.total_rows = 0
+        self.created_count = 0
+
+    def run(self, chunks):
+        self._update(status=ImportStatus.RUNNING)
+        reader = csv.reader(iter_lines(chunks))
+        headers = [header.strip() for header in next(reader, [])]
+        if headers != EXPECTED_HEADERS:
+            self.errors.append({"row": 1, "error": f"Invalid CSV file. Headers do not match. Expected headers: {', '.join(EXPECTED_HEADERS)}"})
+            return self._finish(ImportStatus.FAILED)
+
+        level_ids = level_cache.ids()
+        emails, account_numbers = set(), set()
+        for email, account_number in Teacher.objects.values_list("email", "account_number"):
+            emails.add(email)
+            account_numbers.add(account_number)
+
+        batch = []
+        for row in reader:
+            if not any(row):
+                continue
+            self.total_rows += 1
+            teacher, error = self._build_teacher(row, level_ids, emails, account_numbers)
+            if error:
+                self.errors.append({"row": reader.line_num, "error": error})
+                continue
+
+            emails.add(teacher.email)
+            account_numbers.add(teacher.account_number)
+            batch.append((reader.line_num, teacher))
+            if len(batch) >= self.batch_size:
+                self._save(batch)
+                batch = []
+
+        if batch:
+            self._save(batch)
+        return self._finish(ImportStatus.COMPLETED)
+
+    def _build_teacher(self, row, level_ids, emails, account_numbers):
+        if len(row) != len(EXPECTED_HEADERS):
+            return None, f"Expected {len(EXPECTED_HEADERS)} columns, got {len(row)}"
+
+        first_name, last_name, email, level_id, account_number, bank, account_name = (value.strip() for value in row)
+        if not (first_name and last_name and email and account_number):
+            return None, "first_name, last_name, email and account_number are required"
+        if not level_id.isdigit() or int(level_id) not in level_ids:
+            return None, f"Level with {level_id} does not exist"
+        if email in emails:
+            return None, f"Teacher with {email} already exist"
+        if len(account_number) > 10:
+            return None, "Account number cannot be more than 10 characters"
+        if account_number in account_numbers:
+            return None, f"Account number {account_number} already exist"
+
+        return Teacher(first_name=first_name, last_name=last_name, email=email, level_id=int(level_id),
+                       account_number=account_number, bank=bank or None, account_name=account_name or None), None
+
+    def _save(self, batch):
+        try:
+            with transaction.atomic():
+                Teacher.objects.bulk_create([teacher for _, teacher in batch])
+                transaction.on_commit(invalidate_teachers)
+        except DatabaseError as e:
+            # a concurrent write took one of the emails or account numbers, report the whole batch
+            self.errors.extend({"row": line_num, "error": f"Could not be saved: {e}"} for line_num, _ in batch)
+        else:
+            self.created_count += len(batch)
+
+    def _finish(self, status):
+        return self._update(status=status, total_rows=self.total_rows, created_count=self.created_count,
+                            errors=self.errors, finished_at=timezone.now())
+
+    def _update(self, **fields):
+        for field_name, value in fields.items():
+            setattr(self.teacher_import, field_name, value)
+        self.teacher_import.save(update_fields=list(fields) + ["updated_at"])
+        return self.teacher_import
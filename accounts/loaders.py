@@ -0,0 +1,5 @@
+from accounts.models import Teacher
+from base.loaders import DataLoader
+
+teacher_by_id = DataLoader(Teacher.active_objects.all(), "id")
+teacher_by_email = DataLoader(Teacher.active_objects.all(), "email")
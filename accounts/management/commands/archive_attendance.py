@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.archive import archive_salary_cycle
+from payments.models import SalaryCycle
+
+
+class Command(BaseCommand):
+    help = "move the attendance of salary cycles ended before the retention window to compressed archive files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=int, default=settings.ATTENDANCE_ARCHIVE_RETENTION_DAYS,
+                            help="archive cycles ended more than this many days ago")
+        parser.add_argument("--salary-cycle", type=int, help="id of the salary cycle to archive. it must be outside the retention window")
+        parser.add_argument("--batch-size", type=int, default=settings.ATTENDANCE_ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - timedelta(days=options["retention_days"])
+        # work hours of the cycles stay in the work hour ledger, payroll does not read attendance
+        salary_cycles = SalaryCycle.active_objects.filter(end_date__lt=cutoff).order_by("start_date")
+        if options["salary_cycle"]:
+            salary_cycles = salary_cycles.filter(pk=options["salary_cycle"])
+            if not salary_cycles.exists():
+                raise CommandError(f"Salary cycle {options['salary_cycle']} does not exist or ended after {cutoff}")
+
+        total = 0
+        for salary_cycle in salary_cycles:
+            moved = archive_salary_cycle(salary_cycle, options["batch_size"])
+            if moved:
+                self.stdout.write(f"Salary cycle {salary_cycle.id}: {moved} attendance archived")
+            total += moved
+        self.stdout.write(self.style.SUCCESS(f"! {total} attendance archived successfully"))
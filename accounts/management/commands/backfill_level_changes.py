@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import PromotionDemotion
+
+
+class Command(BaseCommand):
+    help = "set the effective date and previous level of the promotions and demotions recorded before they had them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recorded-before", required=True,
+                            help="when effective dates started being recorded, e.g. the deploy time. "
+                                 "changes recorded before it take effect on the day they were recorded")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            recorded_before = datetime.fromisoformat(options["recorded_before"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if timezone.is_naive(recorded_before):
+            recorded_before = timezone.make_aware(recorded_before)
+
+        # the level a teacher changed from is the one their change before set
+        previous_levels = {}
+        changes = []
+        for change in PromotionDemotion.objects.filter(created_at__lt=recorded_before).order_by("teacher_id", "created_at", "id"
+                                                                                                ).iterator(chunk_size=options["batch_size"]):
+            change.effective_date = timezone.localdate(change.created_at)
+            if change.previous_level_id is None:
+                change.previous_level_id = previous_levels.get(change.teacher_id)
+            previous_levels[change.teacher_id] = change.level_id
+            changes.append(change)
+
+        with transaction.atomic():
+            PromotionDemotion.objects.bulk_update(changes, ["effective_date", "previous_level"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"! {len(changes)} promotions and demotions backfilled successfully"))
@@ -0,0 +1,86 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from base.executors import orm_executor
+from benchmarks.seed import seed
+from benchmarks.suite import Suite, compare
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "baseline.json"
+
+
+class Command(BaseCommand):
+    help = "seed a throwaway test database and benchmark the API hot paths against a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--teachers", type=int, default=1000)
+        parser.add_argument("--levels", type=int, default=5)
+        parser.add_argument("--cycles", type=int, default=12)
+        parser.add_argument("--days", type=int, default=20, help="days of attendance per teacher")
+        parser.add_argument("--import-rows", type=int, default=1000, help="rows of the csv import scenario")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--scenario", action="append", help="only run this scenario, can be repeated")
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+        parser.add_argument("--tolerance", type=float,
+                            help="also compare the timings, allowing this slowdown against the baseline, 0.5 = 50%%. "
+                                 "only meaningful against a baseline saved on the same machine")
+        parser.add_argument("--concurrency", type=int, action="append",
+                            help="also measure list_teachers requests per second at this many concurrent requests, can be repeated")
+        parser.add_argument("--db-latency", type=float, default=1.0,
+                            help="milliseconds every query of --concurrency waits first, like a round trip to a networked database")
+        parser.add_argument("--serialization", action="store_true",
+                            help="also compare the list endpoints with their rows validated against the schema and trusted")
+
+    def handle(self, *args, **options):
+        if options["repeat"] > options["teachers"]:
+            raise CommandError("--repeat cannot be more than --teachers")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # slips of the test database must not land in the real archive
+            with tempfile.TemporaryDirectory() as slip_archive_dir, override_settings(SLIP_ARCHIVE_DIR=slip_archive_dir):
+                emails = seed(options["teachers"], options["levels"], options["cycles"], options["days"])
+                suite = Suite(emails, options["repeat"], options["import_rows"])
+                results = suite.run(only=options["scenario"])
+                throughputs = {concurrency: suite.throughput("/api/accounts/teachers?limit=20", concurrency, concurrency * 20,
+                                                              options["db_latency"] / 1000)
+                               for concurrency in options["concurrency"] or []}
+                serialization = suite.serialization() if options["serialization"] else {}
+        finally:
+            # the executor threads hold connections to the test database
+            orm_executor.close_connections()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, result in results.items():
+            self.stdout.write(f"{name:<28} {result['seconds'] * 1000:>10.2f} ms {result['queries']:>6} queries")
+
+        for concurrency, throughput in throughputs.items():
+            self.stdout.write(f"list_teachers x{concurrency:<4} " + "  ".join(
+                f"{mode} {result['requests_per_second']:>8.1f} req/s {result['connections_opened']:>5} connections"
+                for mode, result in throughput.items()))
+
+        for name, result in serialization.items():
+            self.stdout.write(f"{name:<28} validated {result['validated'] * 1000:>10.2f} ms  trusted {result['trusted'] * 1000:>10.2f} ms")
+
+        baseline_path = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"! Baseline saved to {baseline_path}"))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}, run with --save-baseline"))
+            return
+
+        regressions = compare(results, json.loads(baseline_path.read_text()), options["tolerance"])
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("! No regressions against the baseline"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.helpers import compute_work_seconds
+from accounts.models import Attendance, Teacher
+from payments.helpers import get_teacher_payroll
+from payments.models import Level, SalaryCycle
+
+
+class Command(BaseCommand):
+    help = "print the EXPLAIN plan of the hot queries to check they use the indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--analyze", action="store_true", help="run the queries and show actual timings")
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        teacher = Teacher.active_objects.order_by("id").first()
+        salary_cycle = SalaryCycle.active_objects.filter(start_date__lte=today, end_date__gte=today).first() \
+            or SalaryCycle(start_date=today, end_date=today)
+        email = teacher.email if teacher else "teacher@example.com"
+        teacher_id = teacher.id if teacher else 0
+
+        queries = {
+            "teacher by email": Teacher.active_objects.filter(email=email),
+            "teachers page": Teacher.active_objects.order_by("created_at", "id")[:50],
+            "attendance of a teacher on a date": Attendance.active_objects.filter(teacher_id=teacher_id, date=today),
+            "attendance within a salary cycle": Attendance.active_objects.filter(
+                clock_out__isnull=False, date__range=(salary_cycle.start_date, salary_cycle.end_date)),
+            "salary cycle containing a date": SalaryCycle.active_objects.filter(start_date__lte=today, end_date__gte=today),
+            "salary cycles page": SalaryCycle.active_objects.order_by("created_at", "id")[:50],
+            "levels page": Level.active_objects.order_by("created_at", "id")[:50],
+            "level by id": Level.active_objects.filter(id=teacher.level_id if teacher else 0),
+            "payroll of a salary cycle": get_teacher_payroll(salary_cycle),
+            "work hours recompute of a salary cycle": compute_work_seconds(salary_cycle),
+        }
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain(analyze=options["analyze"]))
+            self.stdout.write("")
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from base.deletion import purge_deleted
+from base.models import BaseModel
+
+
+class Command(BaseCommand):
+    help = "hard delete the rows soft deleted before the retention, and the rows referencing them, with batched raw DELETEs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.PURGE_DELETED_AFTER_DAYS,
+                            help="purge rows soft deleted more than this many days ago")
+        parser.add_argument("--model", action="append", help="app_label.Model to purge, can be repeated. all soft deletable models by default")
+        parser.add_argument("--batch-size", type=int, default=settings.PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["model"]:
+            try:
+                models = [apps.get_model(label) for label in options["model"]]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            if not all(issubclass(model, BaseModel) for model in models):
+                raise CommandError("Only soft deletable models can be purged")
+        else:
+            models = [model for model in apps.get_models() if issubclass(model, BaseModel)]
+
+        before = timezone.now() - timedelta(days=options["days"])
+        total = 0
+        for model in models:
+            for deleted_model, count in purge_deleted(model, before, options["batch_size"]).items():
+                if count:
+                    self.stdout.write(f"{deleted_model._meta.label}: {count} deleted with {model._meta.label}")
+                total += count
+        self.stdout.write(self.style.SUCCESS(f"! {total} rows purged successfully"))
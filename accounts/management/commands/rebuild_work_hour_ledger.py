@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.archive import attendance_archive
+from accounts.helpers import compute_work_seconds
+from accounts.models import Teacher, WorkHourLedger
+from payments.models import SalaryCycle
+
+
+class Command(BaseCommand):
+    help = "rebuild the work hour ledger of salary cycles from attendance"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--salary-cycle", type=int, help="id of the salary cycle to rebuild. all cycles by default")
+
+    def handle(self, *args, **options):
+        salary_cycles = SalaryCycle.active_objects.order_by("start_date")
+        if options["salary_cycle"]:
+            salary_cycles = salary_cycles.filter(pk=options["salary_cycle"])
+            if not salary_cycles.exists():
+                raise CommandError(f"Salary cycle {options['salary_cycle']} does not exist")
+
+        for salary_cycle in salary_cycles:
+            worked = {row["teacher_id"]: int(row["worked_seconds"]) for row in compute_work_seconds(salary_cycle)}
+            # attendance moved out of the table by archive_attendance
+            archived = attendance_archive.open(salary_cycle.id)
+            if archived is not None:
+                with archived:
+                    archived_seconds = archived.work_seconds()
+                for teacher_id in Teacher.objects.filter(pk__in=archived_seconds).values_list("id", flat=True):
+                    worked[teacher_id] = worked.get(teacher_id, 0) + archived_seconds[teacher_id]
+            rows = [WorkHourLedger(teacher_id=teacher_id, salary_cycle=salary_cycle, worked_seconds=seconds)
+                    for teacher_id, seconds in worked.items()]
+            with transaction.atomic():
+                WorkHourLedger.objects.filter(salary_cycle=salary_cycle).exclude(
+                    teacher_id__in=[row.teacher_id for row in rows]).delete()
+                WorkHourLedger.objects.bulk_create(rows, update_conflicts=True, unique_fields=["teacher", "salary_cycle"],
+                                                   update_fields=["worked_seconds", "updated_at"])
+            self.stdout.write(f"Salary cycle {salary_cycle.id}: {len(rows)} teachers")
+        self.stdout.write(self.style.SUCCESS("! Work hours rebuilt successfully"))
@@ -0,0 +1,2 @@
+# former name of rebuild_work_hour_ledger
+from accounts.management.commands.rebuild_work_hour_ledger import Command  # noqa
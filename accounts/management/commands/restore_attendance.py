@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.archive import restore_salary_cycle
+
+
+class Command(BaseCommand):
+    help = "insert the archived attendance of a salary cycle back into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("salary_cycle", type=int, help="id of the archived salary cycle")
+        parser.add_argument("--batch-size", type=int, default=settings.ATTENDANCE_ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        result = restore_salary_cycle(options["salary_cycle"], options["batch_size"])
+        if result is None:
+            raise CommandError(f"Salary cycle {options['salary_cycle']} is not archived")
+
+        archived, restored = result
+        if restored < archived:
+            self.stdout.write(self.style.WARNING(f"{archived - restored} attendance of deleted teachers or already in the database skipped"))
+        self.stdout.write(self.style.SUCCESS(f"! {restored} attendance restored successfully"))
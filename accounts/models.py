@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 from base.models import BaseModel
 from payments.models import Level, SalaryCycle
@@ -22,6 +23,12 @@ class Teacher(BaseModel):
     bank = models.CharField(max_length=150, null=True)
     level = models.ForeignKey(Level, on_delete=models.SET_NULL, null=True, related_name="teachers")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], condition=models.Q(is_deleted=False), name="teacher_active_created_idx"),
+            models.Index(fields=["email"], condition=models.Q(is_deleted=False), name="teacher_active_email_idx"),
+        ]
+
     def __str__(self):
         return self.email
     
@@ -37,14 +44,80 @@ class Attendance(BaseModel):
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name="attendance")
     present = models.BooleanField(default=True) 
 
+    class Meta:
+        constraints = [
+            # also the (teacher_id, date) index of attendance lookups
+            models.UniqueConstraint(fields=["teacher", "date"], condition=models.Q(is_deleted=False),
+                                    name="unique_active_teacher_attendance_date"),
+        ]
+        indexes = [
+            models.Index(fields=["date", "clock_out"], condition=models.Q(is_deleted=False), name="attendance_active_date_idx"),
+        ]
+
     def __str__(self):
         return self.teacher.email
     
 
 class PromotionDemotion(BaseModel):
+    """ a change of the level of a teacher. payroll pays the attendance dated from effective_date at the new level """
     salary_cycle = models.ForeignKey(SalaryCycle, on_delete=models.CASCADE)
     teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE)
     is_promoted = models.BooleanField(default=False)
     is_demoted = models.BooleanField(default=False)
     level = models.ForeignKey(Level, on_delete=models.SET_NULL, null=True, related_name="promotion_level")
-    
+    previous_level = models.ForeignKey(Level, on_delete=models.SET_NULL, null=True, related_name="+")
+    effective_date = models.DateField(default=timezone.localdate)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["effective_date", "teacher"], condition=models.Q(is_deleted=False), name="promotion_active_effective_idx"),
+        ]
+
+
+class WorkHourLedger(BaseModel):
+    """ seconds worked by a teacher within a salary cycle. updated on clock-out """
+    teacher = models.ForeignKey(Teacher, on_delete=models.CASCADE, related_name="work_hours")
+    salary_cycle = models.ForeignKey(SalaryCycle, on_delete=models.CASCADE, related_name="work_hours")
+    worked_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["teacher", "salary_cycle"], name="unique_teacher_salary_cycle_work_hours"),
+        ]
+
+
+class ImportStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    RUNNING = "running", "Running"
+    COMPLETED = "completed", "Completed"
+    FAILED = "failed", "Failed"
+
+
+class TeacherImport(BaseModel):
+    """ a csv upload of teachers and its per-row error report """
+    file_name = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=255, null=True)
+    status = models.CharField(max_length=20, choices=ImportStatus.choices, default=ImportStatus.PENDING)
+    total_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)
+    finished_at = models.DateTimeField(null=True)
+
+
+class ClockEventStatus(models.TextChoices):
+    CLOCKED_IN = "clocked_in", "Clocked in"
+    CLOCKED_OUT = "clocked_out", "Clocked out"
+    DUPLICATE_CLOCK_IN = "duplicate_clock_in", "Duplicate clock in"
+    DUPLICATE_CLOCK_OUT = "duplicate_clock_out", "Duplicate clock out"
+    TEACHER_NOT_FOUND = "teacher_not_found", "Teacher not found"
+    INVALID_TIME = "invalid_time", "Invalid time"
+
+
+class ClockEvent(BaseModel):
+    """ a clock event sent by a device and its result, kept so a replayed event gets the same result """
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    email = models.CharField(max_length=255)
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, related_name="clock_events")
+    clocked_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=ClockEventStatus.choices)
+    message = models.CharField(max_length=255)
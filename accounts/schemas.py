@@ -1,4 +1,12 @@
-from ninja import Schema
+from datetime import date, datetime
+from typing import List, Optional
+
+from django.conf import settings
+from pydantic import Field
+from ninja import Schema, ModelSchema, FilterSchema
+
+from accounts.models import TeacherImport
+
 
 class TokenSchema(Schema):
     access: str
@@ -18,15 +26,61 @@ class TeacherSchema(Schema):
     account_name: str = None
 
 
+class TeacherListSchema(Schema):
+    id: int = None
+    first_name: str = None
+    last_name: str = None
+    email: str = None
+    level_id: Optional[int] = None
+    account_number: str = None
+    bank: Optional[str] = None
+    account_name: Optional[str] = None
+
+
+class TeacherPageSchema(Schema):
+    items: List[TeacherListSchema]
+    next_cursor: Optional[str] = None
+
+
+class TeacherFilterSchema(FilterSchema):
+    level_id: Optional[int] = None
+    bank: Optional[str] = None
+    email: Optional[str] = None
+    search: Optional[str] = Field(None, q=["first_name__icontains", "last_name__icontains", "email__icontains"])
+
+
 class AttendenceSchema(Schema):
     email: str
 
 
+class ClockEventSchema(Schema):
+    idempotency_key: str = Field(..., min_length=1, max_length=64)
+    email: str
+    clocked_at: datetime
+
+
+class ClockEventBatchSchema(Schema):
+    events: List[ClockEventSchema] = Field(..., min_length=1, max_length=settings.ATTENDANCE_BATCH_MAX_EVENTS)
+
+
+class ClockEventResultSchema(Schema):
+    idempotency_key: str
+    status: str
+    message: str
+    replayed: bool = False
+
+
+class ClockEventBatchResultSchema(Schema):
+    results: List[ClockEventResultSchema]
+
+
 class PromotionSchema(Schema):
     salary_cycle_id : int
     email : str
     is_promoted: bool = True
     level_id : int
+    # today, or the start of the salary cycle when it has not started yet
+    effective_date: Optional[date] = None
 
 
 class DemotionSchema(Schema):
@@ -34,6 +88,18 @@ class DemotionSchema(Schema):
     email : str
     is_demoted: bool = True
     level_id : int
+    # today, or the start of the salary cycle when it has not started yet
+    effective_date: Optional[date] = None
+
+
+class ImportErrorSchema(Schema):
+    row: int
+    error: str
+
 
+class TeacherImportSchema(ModelSchema):
+    errors: List[ImportErrorSchema]
 
-   
\ No newline at end of file
+    class Config:
+        model = TeacherImport
+        model_fields = ["id", "file_name", "status", "total_rows", "created_count", "finished_at"]
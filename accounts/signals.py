@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from base.signals import soft_deleted, purged
+from accounts.auth import token_cache
+from accounts.helpers import invalidate_teachers
+from accounts.models import Teacher
+from payments.models import Level
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    """ cached tokens are dropped whenever the user changes: password, deactivation, deletion """
+    # on commit, a token verified against the user from before would otherwise be cached with the new version
+    transaction.on_commit(lambda: token_cache.invalidate(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Teacher)
+def teacher_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_teachers)
+
+
+@receiver(post_delete, sender=Level)
+def level_deleted(sender, instance, **kwargs):
+    # the level of its teachers is set to null by an update, which sends no post_save
+    transaction.on_commit(invalidate_teachers)
+
+
+@receiver(soft_deleted, sender=Teacher)
+def teachers_soft_deleted(sender, **kwargs):
+    transaction.on_commit(invalidate_teachers)
+
+
+@receiver(purged, sender=Level)
+def levels_purged(sender, **kwargs):
+    # the level of their teachers is set to null by the purge
+    invalidate_teachers()
@@ -0,0 +1,16 @@
+from django.core.files.storage import default_storage
+
+from tutorX.celery import app
+from accounts.models import TeacherImport
+from accounts.importers import TeacherImporter
+
+
+@app.task
+def import_teachers(teacher_import_id):
+    """ import a teachers csv too large to be imported within the request """
+    teacher_import = TeacherImport.objects.get(pk=teacher_import_id)
+    try:
+        with default_storage.open(teacher_import.file_path, "rb") as file:
+            TeacherImporter(teacher_import).run(file.chunks())
+    finally:
+        default_storage.delete(teacher_import.file_path)
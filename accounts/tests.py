@@ -1,3 +1,318 @@
-from django.test import TestCase
+import asyncio
+import io
+import tempfile
+import threading
+import time
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.auth import TokenCache
+from accounts.helpers import MIN_CLOCK_OUT_DELAY, apply_clock_events, clock_attendance, compute_work_seconds
+from accounts.importers import TeacherImporter, iter_lines
+from accounts.schemas import ClockEventSchema
+from accounts.models import Attendance, Teacher, TeacherImport, ImportStatus, WorkHourLedger
+from base.cache import bump_version
+from base.pagination import InvalidPagination, KeysetParams, decode_cursor, encode_cursor, keyset_paginate
+from payments.cycles import salary_cycle_index
+from payments.levels import level_cache
+from payments.models import Level, SalaryCycle
+
+
+HEADER = b"first_name,last_name,email,level_id,account_number,bank,account_name\r\n"
+
+
+class TeacherImporterTestCase(TestCase):
+
+    def setUp(self):
+        self.level = Level.objects.create(name="L1", pay_grade=100)
+        level_cache.invalidate()
+
+    def run_import(self, chunks, batch_size=2):
+        teacher_import = TeacherImport.objects.create(file_name="teachers.csv")
+        return TeacherImporter(teacher_import, batch_size=batch_size).run(chunks)
+
+    def row(self, i, email=None, account_number=None):
+        return (f"first{i},last{i},{email or f'teacher{i}@x.com'},{self.level.id},"
+                f"{account_number or f'{i:010d}'},bank,name\r\n").encode()
+
+    def test_rows_are_saved_in_batches(self):
+        teacher_import = self.run_import([HEADER] + [self.row(i) for i in range(5)])
+
+        self.assertEqual(teacher_import.status, ImportStatus.COMPLETED)
+        self.assertEqual((teacher_import.total_rows, teacher_import.created_count, teacher_import.errors), (5, 5, []))
+        self.assertEqual(sorted(Teacher.objects.values_list("email", flat=True)), [f"teacher{i}@x.com" for i in range(5)])
+
+    def test_duplicates_are_reported_by_row(self):
+        Teacher.objects.create(first_name="first", last_name="last", email="taken@x.com", account_number="9999999999",
+                               level=self.level)
+        teacher_import = self.run_import([HEADER, self.row(0), self.row(1, email="taken@x.com"),
+                                          self.row(2, email="teacher0@x.com"), self.row(3, account_number="0000000000"),
+                                          self.row(4, account_number="9999999999"), self.row(5)])
+
+        self.assertEqual((teacher_import.total_rows, teacher_import.created_count), (6, 2))
+        self.assertEqual([error["row"] for error in teacher_import.errors], [3, 4, 5, 6])
+        self.assertEqual(sorted(Teacher.objects.values_list("email", flat=True)), ["taken@x.com", "teacher0@x.com", "teacher5@x.com"])
+
+    def test_invalid_headers_fail_the_import(self):
+        teacher_import = self.run_import([b"first_name,email\r\n", self.row(0)])
+
+        self.assertEqual(teacher_import.status, ImportStatus.FAILED)
+        self.assertEqual(teacher_import.errors[0]["row"], 1)
+        self.assertFalse(Teacher.objects.exists())
+
+    def test_rows_split_across_chunks(self):
+        content = HEADER + "Zoé".encode() + self.row(0)[6:] + self.row(1) + self.row(2, email="teacher0@x.com")
+        # cut inside the é, and between the \r and \n of the first two rows
+        cuts = [len(HEADER) - 1, len(HEADER) + 3, content.index(b"\r\n", len(HEADER)) + 1, len(content) - 5]
+        chunks = [content[start:end] for start, end in zip([0] + cuts, cuts + [len(content)])]
+
+        self.assertEqual(list(iter_lines(chunks)), content.decode().splitlines(keepends=True))
+        teacher_import = self.run_import(chunks)
+        self.assertEqual((teacher_import.total_rows, teacher_import.created_count), (3, 2))
+        self.assertEqual(teacher_import.errors[0]["row"], 4)
+        self.assertEqual(Teacher.objects.get(email="teacher0@x.com").first_name, "Zoé")
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        level = Level.objects.create(name="L1", pay_grade=100)
+        self.teachers = [Teacher.objects.create(first_name=f"first{i}", last_name="last", email=f"teacher{i}@x.com",
+                                                account_number=f"{i:010d}", level=level) for i in range(7)]
+        # all but the first two teachers share a created_at, their order comes from the id
+        created_at = timezone.now().replace(microsecond=123456)
+        for i, teacher in enumerate(self.teachers):
+            teacher.created_at = created_at - timedelta(seconds=1) if i < 2 else created_at
+        Teacher.objects.bulk_update(self.teachers, ["created_at"])
+
+    def pages(self, limit, fields=None):
+        cursor, pages = None, []
+        while True:
+            page = keyset_paginate(Teacher.objects.all(), KeysetParams(cursor=cursor, limit=limit, fields=fields),
+                                   ["id", "email", "first_name"])
+            pages.append(page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_cursor_round_trip(self):
+        teacher = self.teachers[0]
+        self.assertEqual(decode_cursor(encode_cursor(teacher.created_at, teacher.id)), (teacher.created_at, teacher.id))
+        with self.assertRaises(InvalidPagination):
+            decode_cursor("not a cursor")
+
+    def test_pages_cover_every_row_once_in_order(self):
+        expected = [t.id for t in sorted(self.teachers, key=lambda t: (t.created_at, t.id))]
+        for limit in (1, 2, 3, 7, 10):
+            pages = self.pages(limit)
+            self.assertEqual([row["id"] for page in pages for row in page], expected)
+            self.assertTrue(all(len(page) == limit for page in pages[:-1]))
+
+    def test_pages_ending_inside_equal_created_at(self):
+        # pages of 2 end on the 2nd and 3rd of the five tied teachers, the cursor carries on from the id
+        pages = self.pages(2)
+        self.assertEqual([[row["id"] for row in page] for page in pages],
+                         [[t.id for t in self.teachers[i:i + 2]] for i in range(0, 7, 2)])
+
+    def test_projection(self):
+        pages = self.pages(10, fields="email")
+        self.assertEqual(list(pages[0][0]), ["email"])
+        with self.assertRaises(InvalidPagination):
+            self.pages(10, fields="email,password")
+
+
+class WorkHourLedgerTestCase(TestCase):
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(ATTENDANCE_ARCHIVE_DIR=archive_dir.name)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        level = Level.objects.create(name="L1", pay_grade=100)
+        self.now = timezone.now().replace(hour=8, minute=0, second=0, microsecond=250000)
+        today = self.now.date()
+        self.salary_cycle = SalaryCycle.objects.create(start_date=today - timedelta(days=10), end_date=today + timedelta(days=10),
+                                                       average_work_hour=8)
+        self.teachers = [Teacher.objects.create(first_name=f"first{i}", last_name="last", email=f"teacher{i}@x.com",
+                                                account_number=f"{i:010d}", level=level) for i in range(3)]
+        for day in range(3):
+            for i, teacher in enumerate(self.teachers):
+                clock_in = self.now - timedelta(days=day)
+                clock_attendance(teacher.id, teacher.email, clock_in)
+                clock_attendance(teacher.id, teacher.email, clock_in + timedelta(hours=1 + i, seconds=day, microseconds=999999))
+
+    def assertLedgerMatchesAttendance(self):
+        ledger = dict(WorkHourLedger.objects.filter(salary_cycle=self.salary_cycle).values_list("teacher_id", "worked_seconds"))
+        worked = {row["teacher_id"]: int(row["worked_seconds"]) for row in compute_work_seconds(self.salary_cycle)}
+        self.assertEqual(ledger, worked)
+
+    def test_clock_out_keeps_the_ledger_equal_to_attendance(self):
+        self.assertLedgerMatchesAttendance()
+        self.assertEqual(WorkHourLedger.objects.get(teacher=self.teachers[0]).worked_seconds, 3 * 3600 + 3)
+
+    def test_rebuild_brings_a_drifted_ledger_back_to_attendance(self):
+        # attendance edited without the clock statement, the ledger no longer matches it
+        attendance = Attendance.objects.filter(teacher=self.teachers[1]).first()
+        Attendance.objects.filter(pk=attendance.pk).update(clock_out=attendance.clock_out + timedelta(hours=1))
+        Attendance.objects.filter(teacher=self.teachers[2]).update(is_deleted=True)
+
+        call_command("rebuild_work_hour_ledger", stdout=io.StringIO())
+        self.assertLedgerMatchesAttendance()
+        self.assertFalse(WorkHourLedger.objects.filter(teacher=self.teachers[2]).exists())
+
+
+class ClockAttendanceTestCase(TestCase):
+
+    def setUp(self):
+        self.teacher = Teacher.objects.create(first_name="first", last_name="last", email="teacher@x.com",
+                                              account_number="0000000001", level=Level.objects.create(name="L1", pay_grade=100))
+        self.now = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        SalaryCycle.objects.create(start_date=self.now.date(), end_date=self.now.date(), average_work_hour=8)
+
+    def clock(self, after):
+        return clock_attendance(self.teacher.id, self.teacher.email, self.now + after)
+
+    def test_clock_out_only_after_the_delay(self):
+        self.assertIsNone(self.clock(timedelta()).clock_out)
+        self.assertIsNone(self.clock(timedelta(minutes=30)))
+        self.assertIsNone(self.clock(MIN_CLOCK_OUT_DELAY))
+        self.assertIsNone(Attendance.objects.get().clock_out)
+
+        attendance = self.clock(MIN_CLOCK_OUT_DELAY + timedelta(seconds=1))
+        self.assertEqual(attendance.clock_out, self.now + MIN_CLOCK_OUT_DELAY + timedelta(seconds=1))
+        self.assertEqual(WorkHourLedger.objects.get().worked_seconds, 3601)
+
+        # clocked out already
+        self.assertIsNone(self.clock(MIN_CLOCK_OUT_DELAY * 2))
+        self.assertEqual(WorkHourLedger.objects.get().worked_seconds, 3601)
+
+    def test_teacher_with_another_email_is_not_clocked(self):
+        self.assertIsNone(clock_attendance(self.teacher.id, "other@x.com", self.now))
+        self.assertFalse(Attendance.objects.exists())
+
+
+class ConcurrentClockAttendanceTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.teacher = Teacher.objects.create(first_name="first", last_name="last", email="teacher@x.com",
+                                              account_number="0000000001", level=Level.objects.create(name="L1", pay_grade=100))
+        self.now = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        SalaryCycle.objects.create(start_date=self.now.date(), end_date=self.now.date(), average_work_hour=8)
+
+    def double_tap(self, now):
+        """ results of two taps of the same teacher at the same time, each on its own connection """
+        barrier, results = threading.Barrier(2), []
+
+        def tap():
+            try:
+                barrier.wait()
+                results.append(clock_attendance(self.teacher.id, self.teacher.email, now))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=tap) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_double_tap_clocks_once(self):
+        results = self.double_tap(self.now)
+        self.assertEqual(sum(result is not None for result in results), 1)
+        self.assertEqual(Attendance.objects.count(), 1)
+
+        results = self.double_tap(self.now + timedelta(hours=2))
+        self.assertEqual(sum(result is not None for result in results), 1)
+        self.assertEqual(Attendance.objects.get().clock_out, self.now + timedelta(hours=2))
+        self.assertEqual(WorkHourLedger.objects.get().worked_seconds, 2 * 3600)
+
+
+class TokenCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model()(pk=1, username="admin@x.com")
+        self.expires_at = time.time() + 3600
+
+    async def test_hit_is_a_copy_of_the_user(self):
+        token_cache = TokenCache(maxsize=10, ttl=60, check_interval=60)
+        token_cache.set("token", self.user, await token_cache.aversion(self.user.pk), self.expires_at)
+        self.user.username = "changed@x.com"
+
+        user = await token_cache.aget("token")
+        self.assertEqual((user.pk, user.username), (1, "admin@x.com"))
+        user.username = "changed@x.com"
+        self.assertEqual((await token_cache.aget("token")).username, "admin@x.com")
+
+    async def test_version_is_read_once_per_check_interval(self):
+        token_cache = TokenCache(maxsize=10, ttl=60, check_interval=0.2)
+        token_cache.set("token", self.user, await token_cache.aversion(self.user.pk), self.expires_at)
+        self.assertIsNotNone(await token_cache.aget("token"))
+
+        # bumped by another worker, seen once the check interval is over
+        bump_version(token_cache.version_key(self.user.pk))
+        self.assertIsNotNone(await token_cache.aget("token"))
+        await asyncio.sleep(0.2)
+        self.assertIsNone(await token_cache.aget("token"))
+
+    async def test_invalidate_drops_the_tokens_of_the_worker_right_away(self):
+        token_cache = TokenCache(maxsize=10, ttl=60, check_interval=60)
+        token_cache.set("token", self.user, await token_cache.aversion(self.user.pk), self.expires_at)
+        self.assertIsNotNone(await token_cache.aget("token"))
+
+        token_cache.invalidate(self.user.pk)
+        self.assertIsNone(await token_cache.aget("token"))
+
+
+class ClockEventBatchTestCase(TestCase):
+
+    def setUp(self):
+        level = Level.objects.create(name="L1", pay_grade=100)
+        self.teachers = [Teacher.objects.create(first_name=f"first{i}", last_name="last", email=f"teacher{i}@x.com",
+                                                account_number=f"{i:010d}", level=level) for i in range(2)]
+        self.start = (timezone.now() - timedelta(days=5)).replace(hour=8, minute=0, second=0, microsecond=0)
+        # overlapping cycles, the days they share are credited to both
+        today = self.start.date()
+        self.salary_cycles = [SalaryCycle.objects.create(start_date=today - timedelta(days=5), end_date=today + timedelta(days=1),
+                                                         average_work_hour=8),
+                              SalaryCycle.objects.create(start_date=today + timedelta(days=1), end_date=today + timedelta(days=3),
+                                                         average_work_hour=8)]
+        salary_cycle_index.invalidate()
+        # (teacher, clocked at) taps, doubled taps and a tap before the clock-out delay included
+        self.taps = []
+        for day in range(4):
+            for i, teacher in enumerate(self.teachers):
+                clock_in = self.start + timedelta(days=day, minutes=i)
+                self.taps += [(teacher, clock_in), (teacher, clock_in + timedelta(seconds=5)),
+                              (teacher, clock_in + timedelta(minutes=30)),
+                              (teacher, clock_in + timedelta(hours=2 + day, microseconds=500000))]
+
+    def ledger(self):
+        return {(teacher_id, salary_cycle_id): seconds for teacher_id, salary_cycle_id, seconds
+                in WorkHourLedger.objects.values_list("teacher_id", "salary_cycle_id", "worked_seconds")}
+
+    def test_batch_and_single_clock_give_the_same_ledger(self):
+        for teacher, clocked_at in self.taps:
+            clock_attendance(teacher.id, teacher.email, clocked_at)
+        clocked = self.ledger()
+        attendance = set(Attendance.objects.values_list("teacher_id", "date", "clock_in", "clock_out"))
+
+        Attendance.objects.all().delete()
+        WorkHourLedger.objects.all().delete()
+        events = [ClockEventSchema(idempotency_key=f"tap-{n}", email=teacher.email, clocked_at=clocked_at)
+                  for n, (teacher, clocked_at) in enumerate(self.taps)]
+        with self.assertLogs("payments.cycles", "WARNING"):
+            apply_clock_events(events)
+
+        self.assertEqual(self.ledger(), clocked)
+        self.assertEqual(set(Attendance.objects.values_list("teacher_id", "date", "clock_in", "clock_out")), attendance)
+        # the second day is in both cycles
+        self.assertEqual(clocked[(self.teachers[0].id, self.salary_cycles[0].id)], (2 + 3) * 3600)
+        self.assertEqual(clocked[(self.teachers[0].id, self.salary_cycles[1].id)], (3 + 4 + 5) * 3600)
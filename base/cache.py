@@ -0,0 +1,155 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.core.cache import cache
+
+from base.executors import orm_sync_to_async
+from tutorX.db_router import read_from_primary
+
+
+class LRUCache:
+    """
+    Bounded in-process cache. The least recently used key is evicted once maxsize is reached
+    and, when a ttl (seconds) is given, keys expire after it.
+    Safe to share between the event loop and the sync_to_async threads.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_version(key):
+    """ version counter shared by every worker through the django cache """
+    return cache.get(key, 0)
+
+
+async def aget_version(key):
+    return await cache.aget(key, 0)
+
+
+def modified_key(key):
+    """ key of the time the version was last bumped """
+    return f"{key}:modified"
+
+
+def bump_version(key):
+    # set first, a version newer than its time could be mistaken for an old one
+    cache.set(modified_key(key), time.time(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # first bump, or lost by the cache. start from the clock so that a worker
+        # still holding a version from before can not mistake the new one for it
+        cache.add(key, time.time_ns() // 1_000_000, timeout=None)
+        return cache.incr(key)
+
+
+class VersionedSnapshot:
+    """
+    Per-process copy of a small table, rebuilt when the version shared through the django cache changes.
+    The version is checked at most every check_interval seconds and right away after a change made by
+    this worker. The rows of each version are shared through the django cache as well for shared_timeout
+    seconds, so only the first worker to see a new version reads the database.
+    The snapshot and its rows are shared by every request of the worker and must not be modified.
+    Subclasses set version_key and implement load() and build().
+    """
+    version_key = None
+
+    def __init__(self, check_interval, shared_timeout=None):
+        self.check_interval = check_interval
+        self.shared_timeout = shared_timeout
+        self._snapshot = self.build([])
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = Lock()
+
+    def load(self):
+        """ rows of the snapshot, read from the database """
+        raise NotImplementedError
+
+    def build(self, rows):
+        """ the snapshot readers use, swapped as a whole on rebuild """
+        raise NotImplementedError
+
+    def is_fresh(self):
+        return self._version is not None and time.monotonic() - self._checked_at < self.check_interval
+
+    def refresh(self):
+        """ rebuild the snapshot if another worker changed the table """
+        if self.is_fresh():
+            return self._snapshot
+        with self._lock:
+            version = get_version(self.version_key)
+            if version != self._version:
+                self._snapshot = self.build(self._load_shared(version))
+                self._version = version
+            self._checked_at = time.monotonic()
+        return self._snapshot
+
+    async def arefresh(self):
+        if self.is_fresh():
+            return self._snapshot
+        return await orm_sync_to_async(self.refresh)()
+
+    async def arefresh_to(self, version):
+        """ the snapshot, rebuilt right away if it is not at a version just read from the shared cache """
+        if version != self._version:
+            self._checked_at = 0.0
+        return await self.arefresh()
+
+    def _load_shared(self, version):
+        if not self.shared_timeout:
+            return self._load_primary()
+        key = f"{self.version_key}:{version}:rows"
+        rows = cache.get(key)
+        if rows is None:
+            rows = self._load_primary()
+            cache.set(key, rows, timeout=self.shared_timeout)
+        return rows
+
+    def _load_primary(self):
+        # a lagging replica would store stale rows under the new version
+        with read_from_primary():
+            return self.load()
+
+    def invalidate(self):
+        """ call after changing the table, on commit. save() and delete() call it through the model signals,
+        changes that send none, e.g. bulk_create or update(), have to call it themselves """
+        bump_version(self.version_key)
+        self._version = None
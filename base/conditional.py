@@ -0,0 +1,107 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from base.cache import VersionedSnapshot, bump_version, modified_key
+from tutorX.db_router import REPLICA_DB
+
+
+class Validators:
+    """ ETag and Last-Modified of a response, known before the view runs, and the versions they were built from """
+    __slots__ = ("etag", "last_modified", "versions")
+
+    def __init__(self, etag, last_modified, versions):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.versions = versions
+
+    def apply(self, response):
+        response.headers["ETag"] = self.etag
+        if self.last_modified is not None:
+            response.headers["Last-Modified"] = http_date(self.last_modified)
+        if settings.CONDITIONAL_GET_MAX_AGE:
+            patch_cache_control(response, private=True, max_age=settings.CONDITIONAL_GET_MAX_AGE)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def read_versions(version_keys):
+    """ (version, modified at) of each key. a key lost by the cache gets a new version """
+    values = cache.get_many([*version_keys, *map(modified_key, version_keys)])
+    versions = []
+    for key in version_keys:
+        version, modified_at = values.get(key), values.get(modified_key(key))
+        if version is None:
+            # an etag handed out before the loss can not match the new version
+            version, modified_at = bump_version(key), time.time()
+        elif modified_at is None:
+            modified_at = time.time()
+            cache.add(modified_key(key), modified_at, timeout=None)
+        versions.append((version, modified_at))
+    return versions
+
+
+def get_validators(request, version_keys):
+    """
+    validators of a response depending only on the request path and the tables behind the version keys.
+    None right after a change when reads may go to a replica, it could still serve the rows from before
+    """
+    versions = read_versions(version_keys)
+    modified_at = max(modified_at for _, modified_at in versions)
+    now = time.time()
+    if REPLICA_DB in settings.DATABASES and now - modified_at < settings.DB_STICKY_PRIMARY_SECONDS:
+        return None
+    tag = hashlib.sha1(f"{request.get_full_path()}|{versions}".encode()).hexdigest()
+    # http dates are in whole seconds, a change later within the same second would have the same one
+    last_modified = int(modified_at) if now >= int(modified_at) + 1 else None
+    return Validators(quote_etag(tag), last_modified, [version for version, _ in versions])
+
+
+get_validators_async = sync_to_async(get_validators)
+
+
+def conditional_get(*sources):
+    """
+    decorator of async read endpoints whose response only changes with the tables behind the version keys.
+    If-None-Match and If-Modified-Since are answered with a 304 before the view queries anything,
+    other responses get the validators added by the api. it runs after authentication.
+    a VersionedSnapshot the view reads from is given instead of its version key: it is brought to the
+    version of the validators first, a body older than its etag would otherwise be revalidated until the next change
+    """
+    version_keys = [getattr(source, "version_key", source) for source in sources]
+    snapshots = [(index, source) for index, source in enumerate(sources) if isinstance(source, VersionedSnapshot)]
+
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            validators = await get_validators_async(request, version_keys)
+            if validators is None:
+                return await view_func(request, *args, **kwargs)
+
+            response = get_conditional_response(request, etag=validators.etag, last_modified=validators.last_modified,
+                                                response=validators.apply(HttpResponse()))
+            if response.status_code != 200:
+                return response
+            for index, snapshot in snapshots:
+                await snapshot.arefresh_to(validators.versions[index])
+            request.conditional_validators = validators
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_validators(request, response):
+    """ validators of a successful response of a conditional_get endpoint """
+    validators = getattr(request, "conditional_validators", None)
+    if validators is not None and response.status_code == 200:
+        validators.apply(response)
+    return response
@@ -0,0 +1,58 @@
+from django.db import connections, models, transaction
+
+from base.managers import cascading_relations
+from base.signals import purged
+
+
+def _nulling_relations(model):
+    return [relation for relation in model._meta.related_objects
+            if (relation.one_to_many or relation.one_to_one) and relation.on_delete is models.SET_NULL]
+
+
+def _delete(cursor, model, column, ids):
+    """
+    DELETE the rows of the model whose column is one of the ids, and the rows depending on them, without
+    loading them. returns the rows deleted per model. foreign keys are checked on commit, so the order
+    within the transaction does not matter
+    """
+    quote = cursor.db.ops.quote_name
+    table, pk = quote(model._meta.db_table), quote(model._meta.pk.column)
+    cascading, nulling = cascading_relations(model), _nulling_relations(model)
+
+    if not (cascading or nulling):
+        cursor.execute(f"DELETE FROM {table} WHERE {quote(column)} = ANY(%s)", [ids])
+        return {model: cursor.rowcount}
+
+    # ids are only read back when other rows reference them
+    cursor.execute(f"DELETE FROM {table} WHERE {quote(column)} = ANY(%s) RETURNING {pk}", [ids])
+    deleted_ids = [row[0] for row in cursor.fetchall()]
+    deleted = {model: len(deleted_ids)}
+    if not deleted_ids:
+        return deleted
+    for relation in cascading:
+        for related_model, count in _delete(cursor, relation.related_model, relation.field.column, deleted_ids).items():
+            deleted[related_model] = deleted.get(related_model, 0) + count
+    for relation in nulling:
+        related_table, related_column = quote(relation.related_model._meta.db_table), quote(relation.field.column)
+        cursor.execute(f"UPDATE {related_table} SET {related_column} = NULL WHERE {related_column} = ANY(%s)", [deleted_ids])
+    return deleted
+
+
+def purge_deleted(model, before, batch_size):
+    """
+    hard delete the rows of the model soft deleted before the given time, and whatever references them,
+    a batch per transaction. returns the rows deleted per model
+    """
+    deleted = {}
+    pks = model.deleted_objects.filter(updated_at__lt=before).order_by("pk").values_list("pk", flat=True)
+    while True:
+        with transaction.atomic(using=pks.db):
+            batch = list(pks[:batch_size])
+            if not batch:
+                break
+            with connections[pks.db].cursor() as cursor:
+                for related_model, count in _delete(cursor, model, model._meta.pk.column, batch).items():
+                    deleted[related_model] = deleted.get(related_model, 0) + count
+    for related_model in deleted:
+        purged.send(sender=related_model)
+    return deleted
@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from threading import Barrier, Lock
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from base.signals import thread_hop
+
+
+class ExecutorBusy(Exception):
+    """
+    Raise if too many jobs are already waiting for a worker
+    """
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking work called from async views.
+    At most max_workers jobs run at a time and at most max_queue wait for a worker,
+    the time each job waited is recorded.
+    """
+    instances = []
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = Lock()
+        self._pending = 0
+        self._jobs = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        BoundedExecutor.instances.append(self)
+
+    async def run(self, func, *args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise ExecutorBusy
+            self._pending += 1
+
+        submitted_at = time.perf_counter()
+        # like sync_to_async, the job sees the contextvars of the caller
+        context = contextvars.copy_context()
+
+        def job():
+            self._record_wait(time.perf_counter() - submitted_at)
+            return context.run(func, *args)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            thread_hop.send(sender=self, seconds=time.perf_counter() - submitted_at)
+
+    def _record_wait(self, seconds):
+        with self._lock:
+            self._jobs += 1
+            self._wait_seconds += seconds
+            self._max_wait_seconds = max(self._max_wait_seconds, seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "jobs": self._jobs,
+                "wait_seconds": self._wait_seconds,
+                "max_wait_seconds": self._max_wait_seconds,
+            }
+
+
+class OrmExecutor(BoundedExecutor):
+    """
+    BoundedExecutor for ORM work. Its threads live as long as the process, so each keeps its own
+    database connections between jobs for ORM_EXECUTOR_CONN_MAX_AGE seconds, whatever CONN_MAX_AGE is.
+    Expired, broken and failed health check connections are dropped around every job.
+    """
+
+    def _run(self, func, args, kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._keep_alive()
+            close_old_connections()
+
+    def _keep_alive(self):
+        for connection in connections.all(initialized_only=True):
+            # close_at is set from CONN_MAX_AGE when the connection is opened
+            if connection.connection is not None and getattr(connection, "_orm_executor_raw", None) is not connection.connection:
+                connection._orm_executor_raw = connection.connection
+                connection.close_at = time.monotonic() + settings.ORM_EXECUTOR_CONN_MAX_AGE
+
+    async def call(self, func, *args, **kwargs):
+        return await self.run(partial(self._run, func, args, kwargs))
+
+    def close_connections(self):
+        """ close the connections of every thread, e.g. before dropping the database """
+        barrier = Barrier(self.max_workers)
+
+        def close():
+            connections.close_all()
+            # keeps this thread busy so every job lands on a different thread
+            barrier.wait()
+
+        for future in [self._executor.submit(close) for _ in range(self.max_workers)]:
+            future.result()
+
+
+orm_executor = OrmExecutor("orm", max_workers=settings.ORM_EXECUTOR_WORKERS, max_queue=settings.ORM_EXECUTOR_MAX_QUEUE)
+
+
+def orm_sync_to_async(func):
+    """
+    sync_to_async for ORM work. Calls run one at a time on the thread sensitive thread, or in parallel
+    on orm_executor when ORM_EXECUTOR_ENABLED. func must not rely on the connection of its caller,
+    e.g. an open transaction
+    """
+    thread_sensitive = sync_to_async(func)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        if settings.ORM_EXECUTOR_ENABLED:
+            return await orm_executor.call(func, *args, **kwargs)
+        started_at = time.perf_counter()
+        try:
+            return await thread_sensitive(*args, **kwargs)
+        finally:
+            thread_hop.send(sender=None, seconds=time.perf_counter() - started_at)
+    return wrapper
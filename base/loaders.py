@@ -0,0 +1,102 @@
+import asyncio
+import copy
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from django.db import router
+
+from base.executors import orm_sync_to_async
+from tutorX.db_router import aresolve_routing
+
+
+class _Batches:
+    """ batches of one event loop and database """
+    __slots__ = ("pending", "in_flight", "handle")
+
+    def __init__(self):
+        self.pending = {}
+        self.in_flight = {}
+        self.handle = None
+
+
+class DataLoader:
+    """
+    Loads rows of a queryset by a unique field. Keys asked for within `window` seconds (the same event
+    loop tick by default) are fetched with one `field IN (...)` query, and a key whose query is still
+    running is not queried again, whichever request asked for it. Rows are memoized for the request
+    (the asyncio task), every request gets its own copy of a row.
+    """
+
+    def __init__(self, queryset, field, window=None, max_batch_size=None):
+        self.queryset = queryset
+        self.field = field
+        self.window = settings.DATALOADER_WINDOW if window is None else window
+        self.max_batch_size = max_batch_size or settings.DATALOADER_MAX_BATCH_SIZE
+        self._batches = WeakKeyDictionary()
+        self._memos = WeakKeyDictionary()
+        self._fetch_async = orm_sync_to_async(self._fetch)
+
+    async def load(self, key):
+        """ the row whose field equals key, None if there is none """
+        task = asyncio.current_task()
+        memo = self._memos.setdefault(task, {}) if task is not None else {}
+        if key in memo:
+            return memo[key]
+        # _future routes the read on the event loop, the cache lookup it may need is made first
+        await aresolve_routing()
+        # a request giving up must not cancel the query other requests wait for
+        row = await asyncio.shield(self._future(key))
+        memo[key] = copy.copy(row)
+        return memo[key]
+
+    async def load_many(self, keys):
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def clear(self, key):
+        """ forget the row memoized for the request, e.g. after changing it """
+        task = asyncio.current_task()
+        if task in self._memos:
+            self._memos[task].pop(key, None)
+
+    def _future(self, key):
+        loop = asyncio.get_running_loop()
+        # requests reading from different databases are not batched together
+        using = router.db_for_read(self.queryset.model)
+        batches = self._batches.setdefault(loop, {}).setdefault(using, _Batches())
+
+        future = batches.pending.get(key) or batches.in_flight.get(key)
+        if future is not None:
+            return future
+
+        future = batches.pending[key] = loop.create_future()
+        if len(batches.pending) >= self.max_batch_size:
+            if batches.handle is not None:
+                batches.handle.cancel()
+            self._dispatch(loop, batches, using)
+        elif batches.handle is None:
+            batches.handle = loop.call_later(self.window, self._dispatch, loop, batches, using)
+        return future
+
+    def _dispatch(self, loop, batches, using):
+        batch, batches.pending, batches.handle = batches.pending, {}, None
+        batches.in_flight.update(batch)
+        loop.create_task(self._run(batches, batch, using))
+
+    async def _run(self, batches, batch, using):
+        try:
+            rows = await self._fetch_async(list(batch), using)
+        except Exception as exc:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(exc)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(rows.get(key))
+        finally:
+            for key in batch:
+                batches.in_flight.pop(key, None)
+
+    def _fetch(self, keys, using):
+        rows = self.queryset.using(using).filter(**{f"{self.field}__in": keys})
+        return {getattr(row, self.field): row for row in rows}
@@ -1,13 +1,54 @@
-from asgiref.sync import sync_to_async
+from django.db import models, transaction
+from django.utils import timezone
+
+from base.executors import orm_sync_to_async
+from base.signals import soft_deleted
+
+
+def cascading_relations(model):
+    """ reverse relations whose rows are deleted with the rows of the model """
+    return [relation for relation in model._meta.related_objects
+            if (relation.one_to_many or relation.one_to_one) and relation.on_delete is models.CASCADE]
+
+
+def _orm_async(name):
+    async def method(self, *args, **kwargs):
+        return await orm_sync_to_async(getattr(self, name))(*args, **kwargs)
+    method.__name__ = method.__qualname__ = f"a{name}"
+    return method
 
-from django.db import models
 
 class CustomQueryset(models.QuerySet):
+    # django runs its async methods on the thread sensitive thread, these run on orm_executor when ORM_EXECUTOR_ENABLED.
+    # aiterator is left to django, a server-side cursor must stay on the thread that opened it
+    aget, afirst, alast, aearliest, alatest = (_orm_async(name) for name in ("get", "first", "last", "earliest", "latest"))
+    acreate, aget_or_create, aupdate_or_create = (_orm_async(name) for name in ("create", "get_or_create", "update_or_create"))
+    abulk_create, abulk_update, aupdate, adelete = (_orm_async(name) for name in ("bulk_create", "bulk_update", "update", "delete"))
+    acount, aexists, acontains, ain_bulk, aaggregate = (_orm_async(name) for name in ("count", "exists", "contains", "in_bulk", "aggregate"))
+
     def soft_delete(self):
-        return self.update(is_deleted=True)
+        """
+        soft delete the rows, and the soft deletable rows cascading from them, with one UPDATE per table.
+        nothing is loaded into memory. returns the number of rows of this queryset soft deleted
+        """
+        with transaction.atomic(using=self.db):
+            return self._soft_delete(timezone.now())
+
+    def _soft_delete(self, now):
+        # the cascading rows are found through this queryset, so they are updated first
+        pks = self.filter(is_deleted=False).values("pk")
+        for relation in cascading_relations(self.model):
+            related_model = relation.related_model
+            # soft deletable models are the ones with the soft delete managers
+            if hasattr(related_model, "active_objects"):
+                related_model.active_objects.filter(**{f"{relation.field.name}__in": pks})._soft_delete(now)
+        count = self.filter(is_deleted=False).update(is_deleted=True, updated_at=now)
+        if count:
+            soft_deleted.send(sender=self.model)
+        return count
 
     async def asoft_delete(self):
-        return await sync_to_async(self.soft_delete)()
+        return await orm_sync_to_async(self.soft_delete)()
 
 
 class BaseManager(models.Manager):
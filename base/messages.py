@@ -2,10 +2,16 @@ class ResponseMessages:
     TEACHER_NOT_FOUND = "Teacher does not exist"
     LEVEL_NOT_FOUND = "Level does not exist"
     SALARY_CYCLE_NOT_FOUND = "Salary Cycle does not exist"
+    SALARY_CYCLE_OVERLAP = "Salary Cycles overlap an existing Salary Cycle:"
     ATTENDENCE_NOT_FOUND = "Teacher does not exist"
     INVALID_FILE_FORMAT = "File must be in csv"
     DUPLICATE_CLOCK_IN = "You are already clocked in"
     DUPLICATE_CLOCK_OUT = "You are already clocked out"
+    INVALID_CLOCK_TIME = "Clock time is in the future"
     WRONG_CREDENTIALS_MSG = "Incorrect email or password"
     INVALID_TOKEN_MSG = "Invalid token"
-    EXISTING_LEVEL ="You are already on this level"
\ No newline at end of file
+    EXISTING_LEVEL ="You are already on this level"
+    EFFECTIVE_DATE_OUTSIDE_SALARY_CYCLE = "Effective date is not within the salary cycle"
+    PAY_SLIP_RUN_NOT_FOUND = "Pay slip run does not exist"
+    PAY_SLIP_NOT_FOUND = "Pay slip does not exist"
+    IMPORT_NOT_FOUND = "Import does not exist"
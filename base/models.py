@@ -1,8 +1,8 @@
-from asgiref.sync import sync_to_async
+from base.executors import orm_sync_to_async
 
 from django.db import models
 
-from base.managers import ActiveManager, DeletedManager
+from base.managers import ActiveManager, BaseManager, DeletedManager
 
 
 
@@ -11,16 +11,27 @@ class BaseModel(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
 
-    objects = models.Manager()
+    objects = BaseManager()
     active_objects = ActiveManager()
     deleted_objects = DeletedManager()
 
     class Meta:
         abstract = True
 
+    # like the queryset methods, on orm_executor when ORM_EXECUTOR_ENABLED
+    async def asave(self, *args, **kwargs):
+        return await orm_sync_to_async(self.save)(*args, **kwargs)
+
+    async def adelete(self, *args, **kwargs):
+        return await orm_sync_to_async(self.delete)(*args, **kwargs)
+
+    async def arefresh_from_db(self, *args, **kwargs):
+        return await orm_sync_to_async(self.refresh_from_db)(*args, **kwargs)
+
     def soft_delete(self, *args, **kwargs):
+        """ soft delete the row and the rows cascading from it, see CustomQueryset.soft_delete """
+        type(self).active_objects.filter(pk=self.pk).soft_delete()
         self.is_deleted = True
-        self.save(update_fields=['is_deleted'])
 
     async def asoft_delete(self, *args, **kwargs):
-        return await sync_to_async(self.soft_delete)(*args, **kwargs)
+        return await orm_sync_to_async(self.soft_delete)(*args, **kwargs)
@@ -0,0 +1,72 @@
+import base64
+from datetime import datetime
+from typing import Optional
+
+import orjson
+from pydantic import Field
+
+from django.db.models import Q
+
+from ninja import Schema
+
+from base.executors import orm_sync_to_async
+
+
+class InvalidPagination(Exception):
+    pass
+
+
+class KeysetParams(Schema):
+    cursor: Optional[str] = None
+    limit: int = Field(50, ge=1, le=500)
+    fields: Optional[str] = Field(None, description="comma separated fields to return")
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(orjson.dumps([created_at.isoformat(), pk])).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, TypeError):
+        raise InvalidPagination("Invalid cursor")
+
+
+def get_projection(fields, allowed_fields):
+    """ requested fields, checked against the fields of the response schema """
+    if not fields:
+        return list(allowed_fields)
+
+    projection = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = set(projection) - set(allowed_fields)
+    if unknown:
+        raise InvalidPagination(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return projection
+
+
+def keyset_paginate(queryset, params: KeysetParams, allowed_fields):
+    """
+    Page through a queryset ordered by (created_at, id).
+    The cursor is the last row seen, so rows inserted while paging never shift a page.
+    Only the requested fields are selected.
+    """
+    projection = get_projection(params.fields, allowed_fields)
+    queryset = queryset.order_by("created_at", "id")
+    if params.cursor:
+        created_at, pk = decode_cursor(params.cursor)
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+    columns = dict.fromkeys([*projection, "created_at", "id"])
+    rows = list(queryset.values(*columns)[:params.limit + 1])
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+    items = [{field: row[field] for field in projection} for row in rows]
+    return {"items": items, "next_cursor": next_cursor}
+
+
+keyset_paginate_async = orm_sync_to_async(keyset_paginate)
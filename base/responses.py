@@ -0,0 +1,29 @@
+from decimal import Decimal
+
+import orjson
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from base.conditional import add_validators
+from tutorX.renderers import ORJSONRenderer
+
+CONTENT_TYPE = f"{ORJSONRenderer.media_type}; charset={ORJSONRenderer.charset}"
+
+
+def _default(value):
+    # decimal columns are float fields of the response schemas
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def trusted_response(request, data):
+    """
+    data serialized straight to json, without validating it against the response schema of the endpoint,
+    for rows read with .values() of the schema fields, whose types already match them.
+    returned as is for ninja to validate when TRUSTED_RESPONSES_ENABLED is off
+    """
+    if not settings.TRUSTED_RESPONSES_ENABLED:
+        return data
+    return add_validators(request, HttpResponse(orjson.dumps(data, default=_default), content_type=CONTENT_TYPE))
@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+# sent with the model as sender once rows of it are soft deleted by a queryset, which sends no post_save.
+# receivers should run their work on commit
+soft_deleted = Signal()
+# sent with the model as sender once purge_deleted hard deleted soft deleted rows of it, with raw DELETEs
+# and UPDATEs that send no post_delete or post_save
+purged = Signal()
+# sent with the executor as sender, or None for the thread sensitive thread, once an async caller got the result
+# of a call it handed to a worker thread, with the seconds it waited for it
+thread_hop = Signal()
@@ -0,0 +1,56 @@
+import io
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+
+from accounts.models import Admin, Attendance, Teacher
+from payments.models import Level, SalaryCycle
+
+User = get_user_model()
+
+ADMIN_EMAIL = "benchmark@tutorx.test"
+ADMIN_PASSWORD = "benchmark-password"
+BATCH_SIZE = 5000
+
+
+def seed(teachers, levels, cycles, days, cycle_days=14):
+    """
+    Fill the database with benchmark data. The last salary cycle ends today and teachers
+    have attended every one of the last `days` days. Returns the seeded teacher emails.
+    """
+    rnd = random.Random(0)
+    today = timezone.now().date()
+    user = User.objects.create_user(username=ADMIN_EMAIL, password=ADMIN_PASSWORD)
+    Admin.objects.create(user=user)
+
+    level_objs = Level.objects.bulk_create(
+        [Level(name=f"Level {i + 1}", pay_grade=1000 + 250 * i) for i in range(levels)])
+
+    first_start = today - timedelta(days=cycle_days * cycles - 1)
+    SalaryCycle.objects.bulk_create(
+        [SalaryCycle(start_date=first_start + timedelta(days=cycle_days * i),
+                     end_date=first_start + timedelta(days=cycle_days * (i + 1) - 1), average_work_hour=8)
+         for i in range(cycles)])
+
+    teacher_objs = Teacher.objects.bulk_create(
+        [Teacher(first_name=f"First{i}", last_name=f"Last{i}", email=f"teacher{i}@tutorx.test",
+                 account_number=f"{i:010d}", bank="Bank", account_name=f"First{i} Last{i}",
+                 level=rnd.choice(level_objs)) for i in range(teachers)], batch_size=BATCH_SIZE)
+
+    now = timezone.now()
+    attendance = []
+    for teacher in teacher_objs:
+        for day in range(1, days + 1):
+            clock_in = now - timedelta(days=day, hours=9, minutes=rnd.randint(0, 59))
+            attendance.append(Attendance(teacher=teacher, date=clock_in.date(), clock_in=clock_in,
+                                         clock_out=clock_in + timedelta(hours=8, minutes=rnd.randint(0, 59))))
+            if len(attendance) >= BATCH_SIZE:
+                Attendance.objects.bulk_create(attendance)
+                attendance = []
+    Attendance.objects.bulk_create(attendance)
+
+    call_command("rebuild_work_hour_ledger", stdout=io.StringIO())
+    return [teacher.email for teacher in teacher_objs]
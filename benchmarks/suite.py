@@ -0,0 +1,233 @@
+import asyncio
+import statistics
+import time
+from datetime import timedelta
+from threading import Lock
+from unittest import mock
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from accounts.auth import JWTAuth
+from accounts.importers import EXPECTED_HEADERS
+from base.executors import orm_executor
+from benchmarks.seed import ADMIN_EMAIL, ADMIN_PASSWORD
+from payments.models import Level, PaySlipRun
+from payments.tasks import send_teacher_pay_slip
+from tutorX.celery import app
+
+User = get_user_model()
+
+
+class QueryCounter:
+    """ counts the queries of every connection, whichever thread runs them """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class NetworkLatency:
+    """ waits before every query like a round trip to a database over the network, which a local one answers without """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Suite:
+    """
+    Drives the real NinjaAPI in-process through the django test client.
+    Every scenario is run `repeat` times and reports the median seconds and the queries of one run.
+    """
+
+    def __init__(self, emails, repeat, import_rows):
+        self.emails = emails
+        self.repeat = repeat
+        self.import_rows = import_rows
+        self.counter = QueryCounter()
+        self.client = Client()
+        self.admin_client = None
+
+    def run(self, only=None):
+        connection_created.connect(self.counter.install, dispatch_uid="benchmark_query_counter")
+        for connection in connections.all(initialized_only=True):
+            self.counter.install(connection=connection)
+
+        user = User.objects.get(username=ADMIN_EMAIL)
+        self.admin_client = Client(HTTP_AUTHORIZATION=f"Bearer {JWTAuth(user).generate_access_token()}")
+        app.conf.task_always_eager = True
+
+        results = {}
+        for name, scenario in self.scenarios():
+            if only and name not in only:
+                continue
+            results[name] = self.measure(scenario)
+        return results
+
+    def scenarios(self):
+        return [
+            ("attendance_clock_in", self.attendance_clock_in),
+            ("attendance_clock_out", self.attendance_clock_out),
+            ("login", self.login),
+            ("list_teachers", lambda i: self.get("/api/accounts/teachers", {"limit": 100})),
+            ("list_teachers_projected", lambda i: self.get("/api/accounts/teachers", {"limit": 100, "fields": "id,email"})),
+            ("list_salary_cycles", lambda i: self.get("/api/payments/salary-cycle", {"limit": 100})),
+            ("list_levels", lambda i: self.get("/api/payments/level", {"limit": 100})),
+            ("salary_slip", lambda i: self.get("/api/payments/salary-slip")),
+            ("csv_import", self.csv_import),
+            ("pay_slip_task", self.pay_slip_task),
+        ]
+
+    def measure(self, scenario):
+        timings, queries = [], []
+        for i in range(self.repeat):
+            before = self.counter.count
+            started_at = time.perf_counter()
+            scenario(i)
+            timings.append(time.perf_counter() - started_at)
+            queries.append(self.counter.count - before)
+        return {"seconds": round(statistics.median(timings), 6), "queries": max(queries)}
+
+    def get(self, path, params=None):
+        response = self.admin_client.get(path, params or {})
+        assert response.status_code == 200, (path, response.status_code, response.content[:500])
+        return response
+
+    def post_attendance(self, email):
+        response = self.client.post("/api/accounts/attendance", {"email": email}, content_type="application/json")
+        assert response.status_code == 200, response.content
+        return response
+
+    def attendance_clock_in(self, i):
+        self.post_attendance(self.emails[i])
+
+    def attendance_clock_out(self, i):
+        later = timezone.now() + timedelta(hours=2)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            self.post_attendance(self.emails[i])
+
+    def login(self, i):
+        response = self.client.post("/api/accounts/login", {"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD},
+                                    content_type="application/json")
+        assert response.status_code == 200, response.content
+
+    def csv_import(self, i):
+        level_id = Level.objects.values_list("id", flat=True).first()
+        rows = [",".join(EXPECTED_HEADERS)]
+        rows += [f"Import{i}-{n},Teacher,import{i}-{n}@tutorx.test,{level_id},{9_000_000_000 - i * self.import_rows - n},Bank,Import"
+                 for n in range(self.import_rows)]
+        upload = SimpleUploadedFile("teachers.csv", "\n".join(rows).encode(), content_type="text/csv")
+        response = self.admin_client.post("/api/accounts/import/teachers", {"file": upload})
+        assert response.status_code in (200, 202), response.content
+
+    def pay_slip_task(self, i):
+        PaySlipRun.objects.all().delete()
+        mail.outbox = []
+        send_teacher_pay_slip()
+        assert mail.outbox, "no pay slip was sent"
+
+    def serialization(self):
+        """ median seconds of the list endpoints with their rows validated against the response schema, and trusted """
+        paths = [("list_teachers", "/api/accounts/teachers", {"limit": 500}),
+                 ("list_salary_cycles", "/api/payments/salary-cycle", {"limit": 500}),
+                 ("list_levels", "/api/payments/level", {"limit": 500}),
+                 ("salary_slip", "/api/payments/salary-slip", None)]
+        results = {}
+        for name, path, params in paths:
+            results[name], bodies = {}, {}
+            for mode, enabled in (("validated", False), ("trusted", True)):
+                with override_settings(TRUSTED_RESPONSES_ENABLED=enabled):
+                    bodies[mode] = self.get(path, params).json()
+                    results[name][mode] = self.measure(lambda i: self.get(path, params))["seconds"]
+            assert bodies["validated"] == bodies["trusted"], f"{name}: trusted response differs from the validated one"
+        return results
+
+    def throughput(self, path, concurrency, total, latency=0.0):
+        """ requests per second of `total` GETs sent through the ASGI handler, `concurrency` at a time,
+        with the ORM calls on the thread sensitive thread and on the ORM executor. every query waits `latency`
+        seconds first: against a local database the requests are bound by python, not by waiting on it,
+        and concurrency has nothing to overlap """
+        headers = {"Authorization": self.admin_client.defaults["HTTP_AUTHORIZATION"]}
+
+        async def load():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def get():
+                # like the ASGI handler, every request gets its own thread sensitive thread, and closes
+                # its connections when finished, which the test client does not do
+                async with semaphore, ThreadSensitiveContext():
+                    response = await client.get(path, headers=headers)
+                    await sync_to_async(close_old_connections)()
+                    assert response.status_code == 200, (path, response.status_code)
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*(get() for _ in range(total)))
+            requests_per_second = round(total / (time.perf_counter() - started_at), 1)
+            # persistent connections of the request threads would keep the test database open
+            await sync_to_async(connections.close_all)()
+            return requests_per_second
+
+        opened = []
+
+        def count_connection(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        results = {}
+        network = NetworkLatency(latency)
+        # the executor threads reconnect, with the latency
+        orm_executor.close_connections()
+        connection_created.connect(count_connection)
+        connection_created.connect(network.install)
+        try:
+            for mode, enabled in (("thread_sensitive", False), ("orm_executor", True)):
+                opened.clear()
+                with override_settings(ORM_EXECUTOR_ENABLED=enabled):
+                    results[mode] = {"requests_per_second": asyncio.run(load()), "connections_opened": len(opened)}
+        finally:
+            connection_created.disconnect(count_connection)
+            connection_created.disconnect(network.install)
+            orm_executor.close_connections()
+        return results
+
+
+def compare(results, baseline, tolerance=None):
+    """
+    regressions of the results against the baseline: more queries, or with a tolerance, slower by more than it.
+    timings depend on the machine the baseline was saved on, so they are only compared when asked for
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        if result["queries"] > expected["queries"]:
+            regressions.append(f"{name}: {result['queries']} queries, baseline {expected['queries']}")
+        if tolerance is not None and result["seconds"] > expected["seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['seconds']:.4f}s, baseline {expected['seconds']:.4f}s")
+    return regressions
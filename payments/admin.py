@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import SalaryCycle, Level
+from .models import SalaryCycle, Level, PaySlipRun, PaySlipChunk
 
 @admin.register(SalaryCycle)
 class SalaryCycleModelAdmin(admin.ModelAdmin):
@@ -10,4 +10,14 @@ class SalaryCycleModelAdmin(admin.ModelAdmin):
 
 @admin.register(Level)
 class LevelAdmin(admin.ModelAdmin):
-    list_display = ('name', 'pay_grade')
\ No newline at end of file
+    list_display = ('name', 'pay_grade')
+
+
+@admin.register(PaySlipRun)
+class PaySlipRunAdmin(admin.ModelAdmin):
+    list_display = ('salary_cycle', 'status', 'total_teachers', 'sent_count', 'completed_chunks', 'total_chunks')
+
+
+@admin.register(PaySlipChunk)
+class PaySlipChunkAdmin(admin.ModelAdmin):
+    list_display = ('run', 'first_teacher_id', 'last_teacher_id', 'checkpoint', 'status', 'attempts')
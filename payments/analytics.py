@@ -0,0 +1,151 @@
+import io
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.archive import NULL_TIME, attendance_archive
+from accounts.models import Attendance, Teacher
+
+EPOCH = date(1970, 1, 1)
+SECONDS_PER_DAY = 24 * 60 * 60
+# 1970-01-01 was a thursday
+EPOCH_WEEKDAY = 3
+# binary postgres dates count days, and timestamps microseconds, from 2000-01-01
+PG_EPOCH_DAYS = (date(2000, 1, 1) - EPOCH).days
+PG_EPOCH_MICROSECONDS = PG_EPOCH_DAYS * SECONDS_PER_DAY * 1_000_000
+
+# a row of the binary COPY of the attendance columns: the field count, then the length and value of each field
+ATTENDANCE_COPY_ROW = np.dtype([
+    ("fields", ">i2"),
+    ("teacher_id_length", ">i4"), ("teacher_id", ">i8"),
+    ("date_length", ">i4"), ("date", ">i4"),
+    ("clock_in_length", ">i4"), ("clock_in", ">i8"),
+    ("clock_out_length", ">i4"), ("clock_out", ">i8"),
+    ("clocked_out_length", ">i4"), ("clocked_out", "u1"),
+])
+ATTENDANCE_COPY_COLUMNS = ("teacher_id", "date", "clock_in", "clock_out", "clocked_out")
+
+
+def _day(value):
+    return (value - EPOCH).days
+
+
+def _seconds_of_day(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _utc_offset(day):
+    # at noon, a dst change only shifts the clock-ins made within its hours
+    noon = datetime.combine(EPOCH + timedelta(days=day), dt_time(12))
+    return int(timezone.make_aware(noon, timezone.get_current_timezone()).utcoffset().total_seconds())
+
+
+def _clock(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _load_table(salary_cycle):
+    """
+    (teacher ids, day numbers, clock-ins and clock-outs in microseconds since the epoch, NULL_TIME for none)
+    of the active attendance of the cycle, read with a binary COPY straight into arrays. fetched a row at
+    a time into python objects, they would take longer than the query and the analytics together
+    """
+    queryset = Attendance.active_objects.filter(date__range=(salary_cycle.start_date, salary_cycle.end_date)).values_list(
+        "teacher_id", "date", "clock_in", Coalesce("clock_out", "clock_in"),
+        ExpressionWrapper(Q(clock_out__isnull=False), output_field=BooleanField()))
+    connection = connections[queryset.db]
+    sql = connection.ops.compose_sql(*queryset.query.sql_with_params())
+    buffer = io.BytesIO()
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT binary)", buffer)
+    data = buffer.getbuffer()
+    # signature, flags and header extension, then the rows and a two byte trailer
+    start = 19 + int.from_bytes(data[15:19], "big")
+    count, remainder = divmod(len(data) - start - 2, ATTENDANCE_COPY_ROW.itemsize)
+    rows = np.frombuffer(data, dtype=ATTENDANCE_COPY_ROW, offset=start, count=count)
+    # a null, or a column type of another width, would shift every field after it
+    if remainder or bytes(data[-2:]) != b"\xff\xff" or (rows["fields"] != len(ATTENDANCE_COPY_COLUMNS)).any() or any(
+            (rows[f"{name}_length"] != ATTENDANCE_COPY_ROW[name].itemsize).any() for name in ATTENDANCE_COPY_COLUMNS):
+        raise ValueError("Unexpected binary COPY row layout")
+
+    clock_out = rows["clock_out"].astype(np.int64) + PG_EPOCH_MICROSECONDS
+    clock_out[rows["clocked_out"] == 0] = NULL_TIME
+    return (rows["teacher_id"].astype(np.int64), rows["date"].astype(np.int64) + PG_EPOCH_DAYS,
+            rows["clock_in"].astype(np.int64) + PG_EPOCH_MICROSECONDS, clock_out)
+
+
+def _load_archive(salary_cycle):
+    """ the same columns, read from the archive of the cycle when archive_attendance moved its attendance """
+    archived = attendance_archive.open(salary_cycle.id)
+    if archived is None:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+    with archived:
+        active = np.frombuffer(archived.column("is_deleted"), dtype=np.uint8) == 0
+        return tuple(np.frombuffer(archived.column(name), dtype=dtype)[active].astype(np.int64)
+                     for name, dtype in (("teacher_id", np.int64), ("date", np.int32), ("clock_in", np.int64), ("clock_out", np.int64)))
+
+
+def cycle_analytics(salary_cycle):
+    """
+    punctuality, absences and hours of every active teacher within a salary cycle. the attendance is read once
+    and each figure is one vectorized pass over it. days are over once they are past, so today's open
+    attendance is not a missing clock-out and today is not an absence yet
+    """
+    teachers = list(Teacher.active_objects.order_by("id").values_list("id", "email", "first_name", "last_name"))
+    ids = np.array([teacher[0] for teacher in teachers], dtype=np.int64)
+    teacher_id, day, clock_in, clock_out = (np.concatenate(columns) for columns in zip(_load_table(salary_cycle),
+                                                                                       _load_archive(salary_cycle)))
+
+    # row -> teacher position, attendance of deleted teachers is left out
+    index = np.searchsorted(ids, teacher_id)
+    known = index < len(ids)
+    known[known] = ids[index[known]] == teacher_id[known]
+    index, day, clock_in, clock_out = index[known], day[known], clock_in[known], clock_out[known]
+
+    clocked_out = clock_out != NULL_TIME
+    worked = (np.where(clocked_out, clock_out, clock_in) - clock_in) // 1_000_000
+    days, day_index = np.unique(day, return_inverse=True)
+    offsets = np.array([_utc_offset(int(d)) for d in days], dtype=np.int64)
+    clock_in_second = (clock_in // 1_000_000 + offsets[day_index]) % SECONDS_PER_DAY
+
+    weekdays = np.array(settings.ATTENDANCE_WORK_WEEKDAYS, dtype=np.int64)
+    late_after = _seconds_of_day(dt_time.fromisoformat(settings.ATTENDANCE_LATE_AFTER))
+    today = _day(timezone.localdate())
+    last_day = min(_day(salary_cycle.end_date), today - 1)
+    elapsed = np.arange(_day(salary_cycle.start_date), last_day + 1)
+    working_days = int(np.isin((elapsed + EPOCH_WEEKDAY) % 7, weekdays).sum())
+
+    def count(mask=None):
+        return np.bincount(index if mask is None else index[mask], minlength=len(ids))
+
+    def total(values):
+        return np.bincount(index, weights=values, minlength=len(ids))
+
+    days_present = count()
+    days_absent = np.maximum(working_days - count((day <= last_day) & np.isin((day + EPOCH_WEEKDAY) % 7, weekdays)), 0)
+    late_count = count(clock_in_second > late_after)
+    missing_clock_outs = count(~clocked_out & (day < today))
+    worked_seconds = total(worked)
+    clock_in_seconds = total(clock_in_second)
+
+    average_clock_in = [_clock(seconds / present) if present else None
+                        for seconds, present in zip(clock_in_seconds.tolist(), days_present.tolist())]
+    items = [{"teacher_id": id, "email": email, "first_name": first_name, "last_name": last_name, "days_present": present,
+              "days_absent": absent, "late_count": late, "missing_clock_outs": missing, "total_work_hours": hours,
+              "average_clock_in": clock_in}
+             for (id, email, first_name, last_name), present, absent, late, missing, hours, clock_in in zip(
+                 teachers, days_present.tolist(), days_absent.tolist(), late_count.tolist(), missing_clock_outs.tolist(),
+                 (round(seconds / 3600, 2) for seconds in worked_seconds.tolist()), average_clock_in)]
+
+    return {"salary_cycle_id": salary_cycle.id, "start_date": salary_cycle.start_date, "end_date": salary_cycle.end_date,
+            "working_days": working_days, "teachers": len(ids), "days_present": int(days_present.sum()),
+            "days_absent": int(days_absent.sum()), "late_count": int(late_count.sum()),
+            "missing_clock_outs": int(missing_clock_outs.sum()), "total_work_hours": round(float(worked_seconds.sum()) / 3600, 2),
+            "average_clock_in": _clock(clock_in_second.mean()) if len(clock_in_second) else None, "items": items}
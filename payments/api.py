@@ -1,25 +1,51 @@
-from datetime import timedelta
 from typing import List
 from asgiref.sync import sync_to_async
 
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import F, Sum
-from django.template.loader import render_to_string
 
 
-from ninja import Router
+from ninja import Router, Query
 from ninja.responses import codes_4xx
 
-from payments.models import Level, SalaryCycle
-from accounts.models import Teacher
+from accounts.models import Teacher, WorkHourLedger
+from payments.models import Level, SalaryCycle, PaySlipRun
 from base.schemas import Success, Error
-from payments.schemas import LevelCreateSchema, SalaryCycleSchema, LevelSchema, PaymentSlipSchema, BulkCreateCycleSchema
+from base.pagination import KeysetParams, keyset_paginate_async
+from base.executors import orm_sync_to_async
+from base.conditional import conditional_get
+from base.responses import trusted_response
+from payments.schemas import (
+    LevelCreateSchema,
+    SalaryCycleSchema,
+    LevelSchema,
+    PaymentSlipSchema,
+    BulkCreateCycleSchema,
+    PaySlipRunSchema,
+    SalaryCycleListSchema,
+    SalaryCyclePageSchema,
+    SalaryCycleFilterSchema,
+    LevelListSchema,
+    LevelPageSchema,
+    LevelFilterSchema,
+    CycleAnalyticsSchema
+)
 from base.messages import ResponseMessages
-from payments.utils import EmailSender
+from tutorX.db_router import adb_for_read, use_replica
+from payments.analytics import cycle_analytics
+from payments.helpers import get_level_changes, get_teacher_payroll, prorate_payroll, stream_payroll_csv
+from payments.cycles import salary_cycle_index, build_salary_cycles, create_salary_cycles
+from payments.levels import level_cache
+from payments.slips import slip_archive
+from payments.tasks import dispatch_pay_slip_run
 
 
 router = Router(tags=['Payments'])
 
+create_salary_cycles_async = orm_sync_to_async(create_salary_cycles)
+cycle_analytics_async = orm_sync_to_async(cycle_analytics)
+
 
 # SALARY CYCLE
 # @router.post("/salary-cycle", response={200: SalaryCycleSchema, codes_4xx: Error})
@@ -33,21 +59,17 @@ router = Router(tags=['Payments'])
 
 @router.post("/salary-cycle/bulk-create", response={200: List[SalaryCycleSchema], codes_4xx: Error})
 async def create_bulk_salary_cycle(request, payload: BulkCreateCycleSchema):
-    if await SalaryCycle.active_objects.filter(start_date=payload.start_date).aexists():
-        return 400, {"error": "Salary Cycle already exists"}
-
-    start_date = payload.start_date
-    salary_cycles = []
-    for _ in range(payload.number_of_cycle):
-        end_date = start_date + timedelta(days=payload.days_in_cycle - 1)
-        salary_cycle =await SalaryCycle.objects.acreate(start_date=start_date, end_date=end_date, average_work_hour=payload.average_work_hour)
-        start_date = end_date
-        salary_cycles.append(salary_cycle)
-    # print(salary_cycles)
+    """ create number_of_cycle consecutive salary cycles from start_date """
+    salary_cycles, overlapping = await create_salary_cycles_async(
+        build_salary_cycles(payload.start_date, payload.days_in_cycle, payload.number_of_cycle, payload.average_work_hour))
+    if overlapping:
+        return 400, {"error": f"{ResponseMessages.SALARY_CYCLE_OVERLAP} {overlapping.start_date} - {overlapping.end_date}"}
     return salary_cycles
 
 
 @router.get("/salary-cycle/{id}", response={200: SalaryCycleSchema, codes_4xx: Error})
+@conditional_get(salary_cycle_index.version_key)
+@use_replica
 async def get_salary_cycle(request, id: int):
     """ get a single salary-cycle"""
     salary_cycle = await SalaryCycle.active_objects.filter(pk=id).afirst()
@@ -56,10 +78,13 @@ async def get_salary_cycle(request, id: int):
     return salary_cycle
 
 
-@router.get("/salary-cycle", response={200: List[SalaryCycleSchema], codes_4xx: Error})
-async def get_all_salary_cycle(request):
-    """ get all salary cycle. turn to list to get all object asynchoronously"""
-    return await sync_to_async(list)(SalaryCycle.active_objects.all())
+@router.get("/salary-cycle", response={200: SalaryCyclePageSchema, codes_4xx: Error}, exclude_unset=True)
+@conditional_get(salary_cycle_index.version_key)
+@use_replica
+async def get_all_salary_cycle(request, filters: SalaryCycleFilterSchema = Query(...), params: KeysetParams = Query(...)):
+    """ get salary cycles a page at a time. use next_cursor to get the next page"""
+    qs = filters.filter(SalaryCycle.active_objects.all())
+    return trusted_response(request, await keyset_paginate_async(qs, params, SalaryCycleListSchema.model_fields))
 
 
 @router.patch("/salary-cycle/{id}/update", response={200: SalaryCycleSchema, codes_4xx: Error})
@@ -81,11 +106,10 @@ async def update_salary_cycle(request, id: int, data: SalaryCycleSchema):
 
 @router.delete("/salary-cycle/{id}", response={200: Success, codes_4xx: Error})
 async def delete_salary_cycle(request, id: int):
-    salary_cycle = await SalaryCycle.active_objects.filter(pk=id).afirst()
-    if not salary_cycle:
+    """ soft delete a salary cycle with the rows cascading from it. purge_deleted removes them later """
+    if not await SalaryCycle.active_objects.filter(pk=id).asoft_delete():
         return 400, {"error": ResponseMessages.SALARY_CYCLE_NOT_FOUND}
 
-    await salary_cycle.adelete()
     return 200, {"message": "Salary cycle deleted successfully"}
 
 
@@ -98,18 +122,22 @@ async def create_level(request, payload: LevelCreateSchema):
 
 
 @router.get("/level/{id}", response={200: LevelSchema, codes_4xx: Error})
+@conditional_get(level_cache)
 async def get_level(request, id: int):
     """ get a single level"""
-    level = await Level.active_objects.filter(pk=id).afirst()
+    level = await level_cache.aget(id)
     if not level:
         return 400, {"error": ResponseMessages.LEVEL_NOT_FOUND}
     return level
 
 
-@router.get("/level", response={200: List[LevelSchema], codes_4xx: Error})
-async def get_all_level(request):
-    """ get all salary cycle"""
-    return await sync_to_async(list)(Level.active_objects.all())
+@router.get("/level", response={200: LevelPageSchema, codes_4xx: Error}, exclude_unset=True)
+@conditional_get(level_cache.version_key)
+@use_replica
+async def get_all_level(request, filters: LevelFilterSchema = Query(...), params: KeysetParams = Query(...)):
+    """ get levels a page at a time. use next_cursor to get the next page"""
+    qs = filters.filter(Level.active_objects.all())
+    return trusted_response(request, await keyset_paginate_async(qs, params, LevelListSchema.model_fields))
 
 
 @router.patch("/level/{id}/update", response={200: LevelSchema, codes_4xx: Error})
@@ -131,57 +159,88 @@ async def update_level(request, id: int, data: LevelSchema):
 
 @router.delete("/level/{id}", response={200: Success, codes_4xx: Error})
 async def delete_level(request, id: int):
-    level = await Level.active_objects.filter(pk=id).afirst()
+    level = await level_cache.aget(id)
     if not level:
         return 400, {"error": ResponseMessages.LEVEL_NOT_FOUND}
 
     # level cannot be deleted if teachers are in it
-    if await level.teachers.acount() != 0:
+    if await Teacher.active_objects.filter(level_id=id).aexists():
         return 400, {"error": "Level cannot be deleted. Teachers are associated with it"}
 
-    await level.adelete()
+    # the cached level is shared, so it is deleted through a queryset
+    await Level.active_objects.filter(pk=id).asoft_delete()
     return 200, {"message": "Level deleted successfully"}
 
 
 @router.get("/salary-slip", response={200: List[PaymentSlipSchema], 400: Error})
+@use_replica
 def generate_payment_slip(request):
     """ get total work hour of the current salary cycle of teachers """
     current_date = timezone.now().date()
 
-    current_salary_cycle = SalaryCycle.active_objects.filter(
-        start_date__lte=current_date, end_date__gte=current_date).first()
+    current_salary_cycle = salary_cycle_index.get(current_date)
 
     if current_date != current_salary_cycle.end_date:
         return 400, {"error": f"Payment slip cannot be generated til {current_salary_cycle.end_date}."}
     
     # get teacher total work hour and total pay within a salary cycle if there attendance clock-out is not null
-    qs = Teacher.active_objects.filter(attendance__clock_out__isnull=False,
-                                       attendance__date__range=(
-                                           current_salary_cycle.start_date, current_salary_cycle.end_date)
-                                       ).values("email", "account_number"
-                                                ).annotate(total_work_hours=Sum(F('attendance__clock_out__hour') - F('attendance__clock_in__hour'),
-                                                                                )).annotate(total_pay=(F('total_work_hours') * F('level__pay_grade')))
-    # print(qs)
-    return qs
+    # evaluated here, the response is serialized after use_replica is left
+    level_changes = get_level_changes(current_salary_cycle)
+    fields = PaymentSlipSchema.model_fields
+    return trusted_response(request, [{field: teacher[field] for field in fields} for teacher in (
+        prorate_payroll(teacher, level_changes) for teacher in get_teacher_payroll(current_salary_cycle).values("id", *fields))])
+
+
+@router.get("/salary-cycle/{id}/payroll.csv", response={200: None, codes_4xx: Error})
+@use_replica
+async def export_payroll(request, id: int):
+    """ payroll of a salary cycle as csv for the bank upload, streamed as the rows are read """
+    salary_cycle = await salary_cycle_index.aget_by_id(id)
+    if not salary_cycle:
+        return 400, {"error": ResponseMessages.SALARY_CYCLE_NOT_FOUND}
+
+    # the rows are read once the view returned and left use_replica
+    using = await adb_for_read(WorkHourLedger)
+    response = StreamingHttpResponse(stream_payroll_csv(salary_cycle, settings.PAYROLL_EXPORT_CHUNK_SIZE, using),
+                                     content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="payroll-{salary_cycle.start_date}-{salary_cycle.end_date}.csv"'
+    return response
+
+
+@router.get("/salary-cycle/{id}/analytics", response={200: CycleAnalyticsSchema, codes_4xx: Error})
+@use_replica
+async def get_cycle_analytics(request, id: int):
+    """ attendance, punctuality and hours worked of every teacher within a salary cycle """
+    salary_cycle = await salary_cycle_index.aget_by_id(id)
+    if not salary_cycle:
+        return 400, {"error": ResponseMessages.SALARY_CYCLE_NOT_FOUND}
+    return trusted_response(request, await cycle_analytics_async(salary_cycle))
+
+
+@router.get("/salary-cycle/{id}/slips/{teacher_id}", response={200: None, codes_4xx: Error})
+async def download_pay_slip(request, id: int, teacher_id: int):
+    """ the last pay slip sent to a teacher for a salary cycle, read from the slip archive """
+    slip = await sync_to_async(slip_archive.get)(id, teacher_id)
+    if slip is None:
+        return 400, {"error": ResponseMessages.PAY_SLIP_NOT_FOUND}
+    return HttpResponse(slip, content_type="text/html")
+
 
 @router.get("/teacher-slip", response={200:Success})
 def send_teacher_pay_slip(request):
     #send teacher pay slip if today is salary cycle end date
     current_date = timezone.now().date()
-    current_salary_cycle = SalaryCycle.active_objects.filter(
-        start_date__lte=current_date, end_date__gte=current_date).first()
+    current_salary_cycle = salary_cycle_index.get(current_date)
     if current_salary_cycle and current_salary_cycle.end_date == current_date:
-        print("got here")
-        #get teacher total work hour and total pay within a salary cycle if there attendance clock-out is not null 
-        qs = Teacher.active_objects.filter(attendance__clock_out__isnull=False,
-                                           attendance__date__range=(current_salary_cycle.start_date, current_salary_cycle.end_date)
-                                           ).values("email", "account_number", "first_name", "level__pay_grade"
-                                            ).annotate(total_work_hours=Sum(F('attendance__clock_out__hour') - F('attendance__clock_in__hour'),
-                                            )).annotate(total_pay=(F('total_work_hours') * F('level__pay_grade')))
-        for teacher in qs:
-            mail_body = render_to_string(template_name="emails/payment/teacher_pay_slip.html",
-                                        context={"teacher_name": teacher["first_name"], "total_work_hours": teacher["total_work_hours"],
-                                                "pay_per_hour": teacher["level__pay_grade"], "account_number": teacher["account_number"], "total_pay": teacher["total_pay"] })
-            
-            EmailSender.teacher_payment_mail(teacher["email"], mail_body)
+        # pay slips are sent in chunks by the workers
+        dispatch_pay_slip_run(current_salary_cycle)
     return {"message": "Email sent"}
+
+
+@router.get("/teacher-slip/runs/{id}", response={200: PaySlipRunSchema, codes_4xx: Error})
+async def get_pay_slip_run(request, id: int):
+    """ progress of the pay slip dispatch of a salary cycle """
+    run = await PaySlipRun.active_objects.filter(pk=id).afirst()
+    if not run:
+        return 400, {"error": ResponseMessages.PAY_SLIP_RUN_NOT_FOUND}
+    return run
@@ -0,0 +1,109 @@
+import bisect
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from base.cache import VersionedSnapshot
+from payments.models import SalaryCycle
+
+logger = logging.getLogger(__name__)
+
+
+class SalaryCycleIndex(VersionedSnapshot):
+    """ active salary cycles sorted by start date, so the cycle containing a date is found with bisect """
+    version_key = "salary_cycles:version"
+
+    def __init__(self, check_interval, shared_timeout=None):
+        self.overlaps = []
+        super().__init__(check_interval, shared_timeout)
+
+    def load(self):
+        return list(SalaryCycle.active_objects.order_by("start_date", "end_date"))
+
+    def build(self, cycles):
+        # (cycles, start dates, running max of end dates, cycles by id)
+        overlaps, max_ends, max_end = [], [], None
+        latest = None
+        for cycle in cycles:
+            if latest is not None and cycle.start_date <= max_end:
+                overlaps.append((latest.id, cycle.id))
+            if max_end is None or cycle.end_date > max_end:
+                max_end, latest = cycle.end_date, cycle
+            max_ends.append(max_end)
+        if overlaps:
+            logger.warning("Overlapping salary cycles: %s", ", ".join(f"{a} and {b}" for a, b in overlaps))
+
+        self.overlaps = overlaps
+        return cycles, [cycle.start_date for cycle in cycles], max_ends, {cycle.id: cycle for cycle in cycles}
+
+    def _find_all(self, snapshot, date):
+        """ cycles containing the date, the latest started first """
+        cycles, starts, max_ends, _ = snapshot
+        i = bisect.bisect_right(starts, date) - 1
+        # walk back only while an earlier cycle can still reach the date
+        while i >= 0 and max_ends[i] >= date:
+            if cycles[i].end_date >= date:
+                yield cycles[i]
+            i -= 1
+
+    def _find(self, snapshot, date):
+        return next(self._find_all(snapshot, date), None)
+
+    def get(self, date):
+        """ the salary cycle containing the date, the latest started one if cycles overlap """
+        return self._find(self.refresh(), date)
+
+    def get_all(self, date):
+        """ every salary cycle containing the date, as the ledger credits the attendance of the date to each """
+        return list(self._find_all(self.refresh(), date))
+
+    def get_by_id(self, id):
+        return self.refresh()[3].get(id)
+
+    async def aget(self, date):
+        return self._find(await self.arefresh(), date)
+
+    async def aget_by_id(self, id):
+        return (await self.arefresh())[3].get(id)
+
+
+salary_cycle_index = SalaryCycleIndex(check_interval=settings.SALARY_CYCLE_INDEX_CHECK_INTERVAL,
+                                      shared_timeout=settings.REFERENCE_DATA_CACHE_TIMEOUT)
+
+
+def invalidate_salary_cycles():
+    salary_cycle_index.invalidate()
+
+
+def build_salary_cycles(start_date, days_in_cycle, number_of_cycle, average_work_hour):
+    """ consecutive salary cycles, each starting the day after the previous one ends """
+    salary_cycles = []
+    for _ in range(number_of_cycle):
+        end_date = start_date + timedelta(days=days_in_cycle - 1)
+        salary_cycles.append(SalaryCycle(start_date=start_date, end_date=end_date, average_work_hour=average_work_hour))
+        start_date = end_date + timedelta(days=1)
+    return salary_cycles
+
+
+def create_salary_cycles(salary_cycles):
+    """
+    insert consecutive salary cycles in one transaction.
+    returns the first active cycle they overlap instead, if any
+    """
+    with transaction.atomic():
+        # concurrent schedules must not both pass the overlap check
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [SalaryCycle._meta.db_table])
+
+        overlapping = SalaryCycle.active_objects.filter(
+            start_date__lte=salary_cycles[-1].end_date, end_date__gte=salary_cycles[0].start_date
+        ).order_by("start_date").first()
+        if overlapping:
+            return None, overlapping
+
+        # ids are set from the INSERT ... RETURNING, no fetch is needed afterwards
+        salary_cycles = SalaryCycle.objects.bulk_create(salary_cycles)
+        transaction.on_commit(invalidate_salary_cycles)
+    return salary_cycles, None
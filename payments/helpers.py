@@ -0,0 +1,140 @@
+import csv
+import heapq
+import io
+from collections import defaultdict
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+from django.db.models import F, DecimalField, DurationField, ExpressionWrapper, IntegerField
+from django.db.models.functions import Cast, Extract, Floor, Round
+
+from accounts.archive import EPOCH_ORDINAL, NULL_TIME, attendance_archive
+from accounts.models import Attendance, PromotionDemotion, Teacher, WorkHourLedger
+from base.executors import orm_sync_to_async
+
+CENTS = Decimal("0.01")
+
+
+def get_teacher_payroll(salary_cycle):
+    """ teachers total work hour and total pay within a salary cycle, read from the work hour ledger """
+    worked_seconds = Cast("work_hours__worked_seconds", DecimalField(max_digits=20, decimal_places=2))
+    return Teacher.active_objects.filter(work_hours__salary_cycle=salary_cycle, work_hours__worked_seconds__gt=0
+                                         ).values("id", "email", "account_number", "first_name", "level__pay_grade"
+                                                  ).annotate(total_work_seconds=F("work_hours__worked_seconds"),
+                                                             total_work_hours=Round(worked_seconds / 3600, 2),
+                                                             total_pay=Round(ExpressionWrapper(worked_seconds * F("level__pay_grade") / 3600,
+                                                                                               output_field=DecimalField()), 2))
+
+
+def _worked_days(salary_cycle, teacher_ids, using=None):
+    """ (teacher id, date, seconds worked) of the attendance of the teachers within the cycle, archived included, sorted """
+    worked = ExpressionWrapper(F("clock_out") - F("clock_in"), output_field=DurationField())
+    seconds = Cast(Floor(Extract(worked, "epoch")), IntegerField())
+    table = Attendance.active_objects.using(using).filter(teacher_id__in=teacher_ids, clock_out__isnull=False,
+                                                          date__range=(salary_cycle.start_date, salary_cycle.end_date)
+                                                          ).order_by("teacher_id", "date").values_list("teacher_id", "date", seconds)
+    archived_rows = []
+    archived = attendance_archive.open(salary_cycle.id)
+    if archived is not None:
+        with archived:
+            teacher_id = np.frombuffer(archived.column("teacher_id"), dtype=np.int64)
+            clock_out = np.frombuffer(archived.column("clock_out"), dtype=np.int64)
+            rows = np.isin(teacher_id, list(teacher_ids)) & (clock_out != NULL_TIME) & (
+                np.frombuffer(archived.column("is_deleted"), dtype=np.uint8) == 0)
+            days = np.frombuffer(archived.column("date"), dtype=np.int32)[rows]
+            seconds = (clock_out[rows] - np.frombuffer(archived.column("clock_in"), dtype=np.int64)[rows]) // 1_000_000
+            archived_rows = sorted((teacher, date.fromordinal(day + EPOCH_ORDINAL), worked) for teacher, day, worked in zip(
+                teacher_id[rows].tolist(), days.tolist(), seconds.tolist()))
+    return heapq.merge(table.iterator(), archived_rows, key=itemgetter(0, 1))
+
+
+def get_level_changes(salary_cycle, using=None):
+    """
+    {teacher id: (pay per hour, total pay)} of the teachers whose level changed since the salary cycle started,
+    for whom the current level__pay_grade of get_teacher_payroll is not the one of the cycle. the ledger is paid
+    at the level the cycle started at, then the attendance dated from each change within the cycle is paid the
+    difference, in one pass merging the changes and the attendance of those teachers, both sorted by teacher
+    and date. days at no level are not paid, the pay is None like in the query when the teacher had no level
+    through the whole cycle. using is the database alias to read from, routed when None
+    """
+    changes = defaultdict(list)
+    for teacher_id, effective_date, previous_pay_grade, pay_grade in PromotionDemotion.active_objects.using(using).filter(
+            effective_date__gt=salary_cycle.start_date, teacher__is_deleted=False
+    ).order_by("teacher_id", "effective_date", "id").values_list("teacher_id", "effective_date", "previous_level__pay_grade",
+                                                                 "level__pay_grade"):
+        changes[teacher_id].append((effective_date, previous_pay_grade, pay_grade))
+    if not changes:
+        return {}
+
+    ledger = dict(WorkHourLedger.active_objects.using(using).filter(salary_cycle=salary_cycle, teacher_id__in=changes
+                                                                    ).values_list("teacher_id", "worked_seconds"))
+    # the level of a teacher until their first change is the one it changed from
+    starting = {teacher_id: teacher_changes[0][1] for teacher_id, teacher_changes in changes.items()}
+    within = {teacher_id: [(effective_date, pay_grade) for effective_date, _, pay_grade in teacher_changes
+                           if effective_date <= salary_cycle.end_date]
+              for teacher_id, teacher_changes in changes.items()}
+    pay = {teacher_id: worked_seconds * (starting[teacher_id] or 0) for teacher_id, worked_seconds in ledger.items()}
+
+    changed = [teacher_id for teacher_id in ledger if within[teacher_id]]
+    for teacher_id, days in groupby(_worked_days(salary_cycle, changed, using) if changed else (), key=itemgetter(0)):
+        teacher_changes, index, pay_grade = within[teacher_id], 0, starting[teacher_id]
+        for _, day, worked_seconds in days:
+            while index < len(teacher_changes) and teacher_changes[index][0] <= day:
+                pay_grade = teacher_changes[index][1]
+                index += 1
+            if pay_grade != starting[teacher_id]:
+                pay[teacher_id] += worked_seconds * ((pay_grade or 0) - (starting[teacher_id] or 0))
+
+    level_changes = {}
+    for teacher_id, teacher_pay in pay.items():
+        pay_grades = [starting[teacher_id], *(pay_grade for _, pay_grade in within[teacher_id])]
+        total_pay = None
+        if any(pay_grade is not None for pay_grade in pay_grades):
+            total_pay = (Decimal(teacher_pay) / 3600).quantize(CENTS, ROUND_HALF_UP)
+        # the pay per hour shown is the one of the last day of the cycle
+        level_changes[teacher_id] = (pay_grades[-1], total_pay)
+    return level_changes
+
+
+def prorate_payroll(row, level_changes):
+    """ a payroll row of get_teacher_payroll, with the pay from get_level_changes if the level of the teacher changed """
+    level_change = level_changes.get(row["id"])
+    if level_change is not None:
+        pay_grade, row["total_pay"] = level_change
+        if "level__pay_grade" in row:
+            row["level__pay_grade"] = pay_grade
+    return row
+
+
+PAYROLL_CSV_HEADERS = ["teacher_id", "first_name", "email", "account_number", "total_work_hours", "pay_per_hour", "total_pay"]
+
+
+async def stream_payroll_csv(salary_cycle, chunk_size, using):
+    """
+    csv of the payroll of a salary cycle, read from a server-side cursor a chunk of rows at a time.
+    the rows are read after the view returned, from the database alias it resolved
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(PAYROLL_CSV_HEADERS)
+    yield buffer.getvalue()
+
+    rows = 0
+    buffer.seek(0)
+    buffer.truncate()
+    level_changes = await orm_sync_to_async(get_level_changes)(salary_cycle, using)
+    async for teacher in get_teacher_payroll(salary_cycle).using(using).order_by("id").aiterator(chunk_size=chunk_size):
+        teacher = prorate_payroll(teacher, level_changes)
+        writer.writerow([teacher["id"], teacher["first_name"], teacher["email"], teacher["account_number"],
+                         teacher["total_work_hours"], teacher["level__pay_grade"], teacher["total_pay"]])
+        rows += 1
+        if rows % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
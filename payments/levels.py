@@ -0,0 +1,32 @@
+from django.conf import settings
+
+from base.cache import VersionedSnapshot
+from payments.models import Level
+
+
+class LevelCache(VersionedSnapshot):
+    """ active levels by id, so existence checks and pay grade reads do not hit the database """
+    version_key = "levels:version"
+
+    def load(self):
+        return list(Level.active_objects.all())
+
+    def build(self, levels):
+        return {level.id: level for level in levels}
+
+    def get(self, id):
+        return self.refresh().get(id)
+
+    def ids(self):
+        return set(self.refresh())
+
+    async def aget(self, id):
+        return (await self.arefresh()).get(id)
+
+
+level_cache = LevelCache(check_interval=settings.LEVEL_CACHE_CHECK_INTERVAL,
+                         shared_timeout=settings.REFERENCE_DATA_CACHE_TIMEOUT)
+
+
+def invalidate_levels():
+    level_cache.invalidate()
@@ -9,6 +9,11 @@ class SalaryCycle(BaseModel):
     end_date = models.DateField()
     average_work_hour = models.PositiveIntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["start_date", "end_date"], condition=Q(is_deleted=False), name="salarycycle_active_range_idx"),
+            models.Index(fields=["created_at", "id"], condition=Q(is_deleted=False), name="salarycycle_active_created_idx"),
+        ]
 
 
 class Level(BaseModel):
@@ -16,6 +21,41 @@ class Level(BaseModel):
     pay_grade = models.DecimalField(decimal_places=2, max_digits=20)
     # order = models.AutoField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], condition=Q(is_deleted=False), name="level_active_created_idx"),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class PaySlipStatus(models.TextChoices):
+    PENDING = "pending", "Pending"
+    RUNNING = "running", "Running"
+    COMPLETED = "completed", "Completed"
+    FAILED = "failed", "Failed"
+
+
+class PaySlipRun(BaseModel):
+    """ progress of the pay slip dispatch of a salary cycle """
+    salary_cycle = models.OneToOneField(SalaryCycle, on_delete=models.CASCADE, related_name="pay_slip_run")
+    status = models.CharField(max_length=20, choices=PaySlipStatus.choices, default=PaySlipStatus.PENDING)
+    total_teachers = models.PositiveIntegerField(default=0)
+    total_chunks = models.PositiveIntegerField(default=0)
+    completed_chunks = models.PositiveIntegerField(default=0)
+    failed_chunks = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True)
+
+
+class PaySlipChunk(BaseModel):
+    """ a range of teacher ids sent over a single mail connection. checkpoint is the last teacher id sent """
+    run = models.ForeignKey(PaySlipRun, on_delete=models.CASCADE, related_name="chunks")
+    first_teacher_id = models.BigIntegerField()
+    last_teacher_id = models.BigIntegerField()
+    checkpoint = models.BigIntegerField(null=True)
+    status = models.CharField(max_length=20, choices=PaySlipStatus.choices, default=PaySlipStatus.PENDING)
+    sent_count = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True)
@@ -1,17 +1,17 @@
 from datetime import date
 from decimal import Decimal
 from pydantic import Field 
-from typing import ClassVar
+from typing import ClassVar, List, Optional
 
-from ninja import Schema, ModelSchema
+from ninja import Schema, ModelSchema, FilterSchema
 
-from payments.models import SalaryCycle, Level
+from payments.models import SalaryCycle, Level, PaySlipRun
 
 
 class BulkCreateCycleSchema(Schema):
-    days_in_cycle : int
+    days_in_cycle : int = Field(..., ge=1)
     average_work_hour: int
-    number_of_cycle : int
+    number_of_cycle : int = Field(..., ge=1, le=1000)
     start_date : date
 
 
@@ -21,6 +21,24 @@ class SalaryCycleSchema(ModelSchema):
         model_fields = ["id", "start_date", "end_date", "average_work_hour"]
 
 
+class SalaryCycleListSchema(Schema):
+    id: int = None
+    start_date: date = None
+    end_date: date = None
+    average_work_hour: int = None
+
+
+class SalaryCyclePageSchema(Schema):
+    items: List[SalaryCycleListSchema]
+    next_cursor: Optional[str] = None
+
+
+class SalaryCycleFilterSchema(FilterSchema):
+    start_date_from: Optional[date] = Field(None, q="start_date__gte")
+    end_date_to: Optional[date] = Field(None, q="end_date__lte")
+    on_date: Optional[date] = Field(None, q=["start_date__lte", "end_date__gte"], expression_connector="AND")
+
+
 class LevelCreateSchema(Schema):
     name: str
     pay_grade: float
@@ -32,10 +50,63 @@ class LevelSchema(Schema):
     pay_grade: float
     
 
+class LevelListSchema(Schema):
+    id: int = None
+    name: str = None
+    pay_grade: float = None
+
+
+class LevelPageSchema(Schema):
+    items: List[LevelListSchema]
+    next_cursor: Optional[str] = None
+
+
+class LevelFilterSchema(FilterSchema):
+    name: Optional[str] = Field(None, q="name__icontains")
+    min_pay_grade: Optional[Decimal] = Field(None, q="pay_grade__gte")
+    max_pay_grade: Optional[Decimal] = Field(None, q="pay_grade__lte")
+
+
 class PaymentSlipSchema(Schema):
     email: str
     account_number: str
-    total_work_hours: int
+    total_work_seconds: int
+    total_work_hours: float
     total_pay: float
     # start_date: date
     # end_date: date
+
+
+class PaySlipRunSchema(ModelSchema):
+    class Config:
+        model = PaySlipRun
+        model_fields = ["id", "salary_cycle", "status", "total_teachers", "total_chunks",
+                        "completed_chunks", "failed_chunks", "sent_count", "finished_at"]
+
+
+class TeacherAttendanceSummarySchema(Schema):
+    teacher_id: int
+    email: str
+    first_name: str
+    last_name: str
+    days_present: int
+    days_absent: int
+    late_count: int
+    missing_clock_outs: int
+    total_work_hours: float
+    average_clock_in: Optional[str] = None
+
+
+class CycleAnalyticsSchema(Schema):
+    salary_cycle_id: int
+    start_date: date
+    end_date: date
+    working_days: int
+    teachers: int
+    days_present: int
+    days_absent: int
+    late_count: int
+    missing_clock_outs: int
+    total_work_hours: float
+    average_clock_in: Optional[str] = None
+    items: List[TeacherAttendanceSummarySchema]
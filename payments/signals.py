@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from base.signals import soft_deleted
+
+from payments.cycles import invalidate_salary_cycles
+from payments.levels import invalidate_levels
+from payments.models import SalaryCycle, Level
+
+
+# other workers must not rebuild their copy before the change is visible to them,
+# so the shared versions are bumped on commit
+@receiver([post_save, post_delete], sender=SalaryCycle)
+def salary_cycle_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_salary_cycles)
+
+
+@receiver([post_save, post_delete], sender=Level)
+def level_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_levels)
+
+
+@receiver(soft_deleted, sender=SalaryCycle)
+def salary_cycles_soft_deleted(sender, **kwargs):
+    transaction.on_commit(invalidate_salary_cycles)
+
+
+@receiver(soft_deleted, sender=Level)
+def levels_soft_deleted(sender, **kwargs):
+    transaction.on_commit(invalidate_levels)
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import get_template
+
+PAY_SLIP_TEMPLATE = "emails/payment/teacher_pay_slip.html"
+
+
+@lru_cache(maxsize=None)
+def get_pay_slip_template():
+    """ the pay slip template, compiled once per process """
+    return get_template(PAY_SLIP_TEMPLATE)
+
+
+def pay_slip_context(teacher):
+    """ template context of a payroll row """
+    return {"teacher_name": teacher["first_name"], "total_work_hours": teacher["total_work_hours"],
+            "pay_per_hour": teacher["level__pay_grade"], "account_number": teacher["account_number"],
+            "total_pay": teacher["total_pay"]}
+
+
+@lru_cache(maxsize=None)
+def _template_digest():
+    return hashlib.sha256(get_pay_slip_template().template.source.encode()).hexdigest()
+
+
+def context_digest(context):
+    """ identifies the slip rendered from a context, by this version of the template, without rendering it """
+    payload = json.dumps(context, sort_keys=True, default=str) + _template_digest()
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SlipArchive:
+    """
+    Rendered pay slips on disk, at <root>/<salary cycle id>/<teacher id>/<sha256 of the slip>.html.
+    A slip is never overwritten. The `latest` file of a teacher holds the digest of the context
+    and the hash of the slip last rendered from it, so a resend with unchanged pay reads the slip back.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        return Path(self._root or settings.SLIP_ARCHIVE_DIR)
+
+    def _dir(self, salary_cycle_id, teacher_id):
+        return self.root / str(salary_cycle_id) / str(teacher_id)
+
+    def put(self, salary_cycle_id, teacher_id, html, digest):
+        """ store a slip and point the teacher's latest slip at it, returns its hash """
+        content = html.encode()
+        sha = hashlib.sha256(content).hexdigest()
+        directory = self._dir(salary_cycle_id, teacher_id)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{sha}.html"
+        if not path.exists():
+            _write_atomic(path, content)
+        _write_atomic(directory / "latest", f"{digest} {sha}".encode())
+        return sha
+
+    def _latest(self, salary_cycle_id, teacher_id):
+        try:
+            return (self._dir(salary_cycle_id, teacher_id) / "latest").read_text().split()
+        except FileNotFoundError:
+            return None, None
+
+    def get(self, salary_cycle_id, teacher_id, sha=None):
+        """ bytes of a slip, the latest one when no hash is given """
+        if sha is None:
+            sha = self._latest(salary_cycle_id, teacher_id)[1]
+            if sha is None:
+                return None
+        try:
+            return (self._dir(salary_cycle_id, teacher_id) / f"{sha}.html").read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def lookup(self, salary_cycle_id, teacher_id, digest):
+        """ the latest slip if it was rendered from a context with this digest """
+        latest_digest, sha = self._latest(salary_cycle_id, teacher_id)
+        if latest_digest != digest:
+            return None
+        content = self.get(salary_cycle_id, teacher_id, sha)
+        return content.decode() if content is not None else None
+
+
+def _write_atomic(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+slip_archive = SlipArchive()
+
+
+def render_pay_slips(salary_cycle_id, teachers):
+    """
+    pay slip of each payroll row, in order. slips already archived for the same context are read back,
+    the others are rendered and archived. chunks of a run render in parallel on the celery worker processes
+    """
+    template = get_pay_slip_template()
+    slips = []
+    for teacher in teachers:
+        context = pay_slip_context(teacher)
+        digest = context_digest(context)
+        slip = slip_archive.lookup(salary_cycle_id, teacher["id"], digest)
+        if slip is None:
+            slip = template.render(context)
+            slip_archive.put(salary_cycle_id, teacher["id"], slip, digest)
+        slips.append(slip)
+    return slips
@@ -1,29 +1,136 @@
+from datetime import timedelta
+
+from celery import group
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F, Q, Sum
 from django.utils import timezone
-from django.db.models import F, Sum
-from django.template.loader import render_to_string
 
 from tutorX.celery import app
-from payments.models import SalaryCycle
-from accounts.models import Teacher
+from payments.models import PaySlipRun, PaySlipChunk, PaySlipStatus
+from payments.cycles import salary_cycle_index
+from payments.helpers import get_level_changes, get_teacher_payroll, prorate_payroll
+from payments.slips import render_pay_slips
 from payments.utils import EmailSender
 
+
+def start_pay_slip_run(salary_cycle):
+    """ create the run of a salary cycle and split its teachers into chunks. returns (run, created),
+    an existing run is returned as is so that a re-triggered dispatch resumes it """
+    with transaction.atomic():
+        run, created = PaySlipRun.objects.select_for_update().get_or_create(salary_cycle=salary_cycle)
+        if not created:
+            return run, False
+
+        teacher_ids = list(get_teacher_payroll(salary_cycle).order_by("id").values_list("id", flat=True))
+        size = settings.PAY_SLIP_CHUNK_SIZE
+        chunks = [PaySlipChunk(run=run, first_teacher_id=ids[0], last_teacher_id=ids[-1])
+                  for ids in (teacher_ids[i:i + size] for i in range(0, len(teacher_ids), size))]
+        PaySlipChunk.objects.bulk_create(chunks)
+
+        run.total_teachers = len(teacher_ids)
+        run.total_chunks = len(chunks)
+        run.status = PaySlipStatus.RUNNING if chunks else PaySlipStatus.COMPLETED
+        run.finished_at = None if chunks else timezone.now()
+        run.save(update_fields=["total_teachers", "total_chunks", "status", "finished_at", "updated_at"])
+    return run, True
+
+
+def _stale_before():
+    """ a running chunk whose checkpoint has not moved since is held by a lost worker """
+    return timezone.now() - timedelta(seconds=settings.PAY_SLIP_CHUNK_STALE_AFTER)
+
+
+def dispatch_pay_slip_run(salary_cycle):
+    """ fan out the chunks of a new salary cycle run across workers, the failed chunks of a failed run,
+    or the stale chunks of a running run. the other chunks of a run still going are already queued or being sent,
+    dispatching them again would send their slips twice """
+    run, created = start_pay_slip_run(salary_cycle)
+    if created:
+        chunk_ids = list(run.chunks.values_list("id", flat=True))
+    elif run.status == PaySlipStatus.RUNNING:
+        # chunks of a lost worker are sent again from their checkpoint
+        stale = run.chunks.filter(status=PaySlipStatus.RUNNING, updated_at__lt=_stale_before())
+        chunk_ids = list(stale.values_list("id", flat=True))
+        if not chunk_ids:
+            return run
+    elif run.status == PaySlipStatus.FAILED:
+        with transaction.atomic():
+            run = PaySlipRun.objects.select_for_update().get(pk=run.pk)
+            if run.status != PaySlipStatus.FAILED:
+                return run
+            # failed chunks are sent again from their checkpoint
+            chunk_ids = list(run.chunks.filter(status=PaySlipStatus.FAILED).values_list("id", flat=True))
+            PaySlipChunk.objects.filter(id__in=chunk_ids).update(status=PaySlipStatus.PENDING)
+            PaySlipRun.objects.filter(pk=run.pk).update(status=PaySlipStatus.RUNNING, failed_chunks=0)
+    else:
+        return run
+    group(send_pay_slip_chunk.s(chunk_id) for chunk_id in chunk_ids).apply_async()
+    return run
+
+
+def _finish_chunk(chunk, status, **run_counters):
+    """ mark a chunk as finished, count its slips into the run and close the run once every chunk is done """
+    PaySlipChunk.objects.filter(pk=chunk.pk).update(status=status, updated_at=timezone.now())
+    with transaction.atomic():
+        run = PaySlipRun.objects.select_for_update().get(pk=chunk.run_id)
+        for counter, value in run_counters.items():
+            setattr(run, counter, getattr(run, counter) + value)
+        # summed over the chunks rather than added to, a chunk sent over several attempts is counted once
+        run.sent_count = run.chunks.aggregate(sent_count=Sum("sent_count"))["sent_count"] or 0
+        update_fields = list(run_counters) + ["sent_count", "updated_at"]
+        if run.completed_chunks + run.failed_chunks >= run.total_chunks:
+            run.status = PaySlipStatus.FAILED if run.failed_chunks else PaySlipStatus.COMPLETED
+            run.finished_at = timezone.now()
+            update_fields += ["status", "finished_at"]
+        run.save(update_fields=update_fields)
+
+
+# acknowledged once sent, the chunk of a worker lost midway is delivered again and resumed from its checkpoint
+@app.task(bind=True, max_retries=settings.PAY_SLIP_CHUNK_MAX_RETRIES, acks_late=True, reject_on_worker_lost=True)
+def send_pay_slip_chunk(self, chunk_id):
+    """ render the pay slips of a chunk, then send them over one mail connection, resuming after its checkpoint """
+    # claimed by one worker at a time, a chunk delivered twice is not sent twice
+    claimable = Q(status=PaySlipStatus.PENDING) | Q(status=PaySlipStatus.RUNNING, updated_at__lt=_stale_before())
+    if not PaySlipChunk.objects.filter(claimable, pk=chunk_id).update(
+            status=PaySlipStatus.RUNNING, attempts=F("attempts") + 1, updated_at=timezone.now()):
+        return
+    chunk = PaySlipChunk.objects.select_related("run__salary_cycle").get(pk=chunk_id)
+    qs = get_teacher_payroll(chunk.run.salary_cycle).filter(
+        id__range=(chunk.first_teacher_id, chunk.last_teacher_id)).order_by("id")
+    if chunk.checkpoint is not None:
+        qs = qs.filter(id__gt=chunk.checkpoint)
+
+    try:
+        # read from the primary: the run starts on the end date of the cycle, while teachers are still
+        # clocking out into the ledger, and a lagging replica would send slips missing the latest hours
+        level_changes = get_level_changes(chunk.run.salary_cycle)
+        teachers = [prorate_payroll(teacher, level_changes) for teacher in qs]
+        slips = render_pay_slips(chunk.run.salary_cycle_id, teachers)
+        with get_connection() as connection:
+            for teacher, slip in zip(teachers, slips):
+                EmailSender.teacher_payment_mail(teacher["email"], slip, connection=connection)
+                PaySlipChunk.objects.filter(pk=chunk.pk).update(
+                    checkpoint=teacher["id"], sent_count=F("sent_count") + 1, updated_at=timezone.now())
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            PaySlipChunk.objects.filter(pk=chunk.pk).update(last_error=repr(exc))
+            _finish_chunk(chunk, PaySlipStatus.FAILED, failed_chunks=1)
+            raise
+        # released for the retry to claim
+        PaySlipChunk.objects.filter(pk=chunk.pk).update(
+            last_error=repr(exc), status=PaySlipStatus.PENDING, updated_at=timezone.now())
+        raise self.retry(exc=exc, countdown=settings.PAY_SLIP_CHUNK_RETRY_DELAY * 2 ** self.request.retries)
+
+    _finish_chunk(chunk, PaySlipStatus.COMPLETED, completed_chunks=1)
+
+
 @app.task
 def send_teacher_pay_slip():
     #send teacher pay slip if today is salary cycle end date
     current_date = timezone.now().date()
-    # print(current_date)
-    current_salary_cycle = SalaryCycle.active_objects.filter(
-        start_date__lte=current_date, end_date__gte=current_date).first()
+    current_salary_cycle = salary_cycle_index.get(current_date)
     if current_salary_cycle and current_salary_cycle.end_date == current_date:
-        #get teacher total work hour and total pay within a salary cycle if there attendance clock-out is not null 
-        qs = Teacher.active_objects.filter(attendance__clock_out__isnull=False
-                                           ).values("email", "account_number", "first_name"
-                                            ).annotate(total_work_hours=Sum(F('attendance__clock_out__hour') - F('attendance__clock_in__hour'),
-                                            )).filter(attendance__date__range=(current_salary_cycle.start_date, current_salary_cycle.end_date)
-                                            ).annotate(total_pay=(F('total_work_hours') * F('level__pay_grade')))
-        for teacher in qs:
-            mail_body = render_to_string(template_name="emails/payment/teacher_pay_slip.html",
-                                        context={"teacher_name": teacher["first_name"], "total_work_hours": teacher["total_work_hours"],
-                                                "pay_per_hour": teacher["level__pay_grade"], "account_number": teacher["account_number"], "total_pay": teacher["total_pay"]})
-            
-            EmailSender.teacher_payment_mail(teacher["email"], mail_body)
+        dispatch_pay_slip_run(current_salary_cycle)
@@ -1,3 +1,268 @@
-from django.test import TestCase
+import io
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.archive import archive_salary_cycle
+from accounts.models import Attendance, PromotionDemotion, Teacher, WorkHourLedger
+from payments.analytics import cycle_analytics
+from payments.helpers import get_level_changes, get_teacher_payroll, prorate_payroll
+from payments.models import Level, SalaryCycle, PaySlipChunk, PaySlipStatus
+from payments.tasks import dispatch_pay_slip_run, send_pay_slip_chunk
+from payments.utils import EmailSender
+
+
+class PaySlipRunTestCase(TestCase):
+    """ pay slips are sent in chunks of 2 teachers, with 5 teachers on the payroll """
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(SLIP_ARCHIVE_DIR=archive_dir.name, ATTENDANCE_ARCHIVE_DIR=archive_dir.name,
+                                             PAY_SLIP_CHUNK_SIZE=2, PAY_SLIP_CHUNK_RETRY_DELAY=0)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        today = timezone.localdate()
+        level = Level.objects.create(name="L1", pay_grade=100)
+        self.salary_cycle = SalaryCycle.objects.create(start_date=today - timedelta(days=30), end_date=today,
+                                                       average_work_hour=8)
+        self.teachers = [Teacher.objects.create(first_name=f"first{i}", last_name="last", email=f"teacher{i}@x.com",
+                                                account_number=f"{i:010d}", level=level) for i in range(5)]
+        WorkHourLedger.objects.bulk_create([WorkHourLedger(teacher=teacher, salary_cycle=self.salary_cycle, worked_seconds=3600)
+                                            for teacher in self.teachers])
+
+    def dispatch(self):
+        """ chunk ids the dispatch queues, without running them """
+        with mock.patch("payments.tasks.group") as group:
+            run = dispatch_pay_slip_run(self.salary_cycle)
+        queued = [signature.args[0] for signature in group.call_args.args[0]] if group.called else []
+        return run, queued
+
+    def test_run_sends_every_slip_once(self):
+        run, queued = self.dispatch()
+        self.assertEqual(len(queued), 3)
+        for chunk_id in queued:
+            send_pay_slip_chunk.apply(args=(chunk_id,))
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, PaySlipStatus.COMPLETED)
+        self.assertEqual((run.completed_chunks, run.sent_count), (3, 5))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(t.email for t in self.teachers))
+
+    def test_chunk_delivered_twice_is_sent_once(self):
+        run, queued = self.dispatch()
+        PaySlipChunk.objects.filter(pk=queued[0]).update(status=PaySlipStatus.RUNNING, updated_at=timezone.now())
+        send_pay_slip_chunk.apply(args=(queued[0],))
+        self.assertEqual(len(mail.outbox), 0)
+
+        PaySlipChunk.objects.filter(pk=queued[0]).update(status=PaySlipStatus.COMPLETED)
+        send_pay_slip_chunk.apply(args=(queued[0],))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_dispatch_of_a_running_run_queues_nothing(self):
+        self.dispatch()
+        run, queued = self.dispatch()
+        self.assertEqual(run.status, PaySlipStatus.RUNNING)
+        self.assertEqual(queued, [])
+
+    def test_retry_resumes_after_the_checkpoint(self):
+        run, queued = self.dispatch()
+        send_mail = EmailSender.teacher_payment_mail
+        calls = []
+
+        def fail_second_mail(*args, **kwargs):
+            calls.append(args[0])
+            if len(calls) == 2:
+                raise ConnectionError("mail server went away")
+            return send_mail(*args, **kwargs)
+
+        with mock.patch.object(EmailSender, "teacher_payment_mail", side_effect=fail_second_mail):
+            send_pay_slip_chunk.apply(args=(queued[0],))
+
+        chunk = PaySlipChunk.objects.get(pk=queued[0])
+        self.assertEqual(chunk.status, PaySlipStatus.COMPLETED)
+        self.assertEqual((chunk.attempts, chunk.sent_count, chunk.checkpoint), (2, 2, self.teachers[1].id))
+        self.assertIn("mail server went away", chunk.last_error)
+        # the first teacher is not mailed again by the retry
+        self.assertEqual(calls, [self.teachers[0].email, self.teachers[1].email, self.teachers[1].email])
+        self.assertEqual([message.to[0] for message in mail.outbox], [self.teachers[0].email, self.teachers[1].email])
+        run.refresh_from_db()
+        self.assertEqual(run.sent_count, 2)
+
+    def test_failed_chunk_is_sent_again_by_the_next_dispatch(self):
+        run, queued = self.dispatch()
+        with mock.patch.object(send_pay_slip_chunk, "max_retries", 0), \
+                mock.patch.object(EmailSender, "teacher_payment_mail", side_effect=ConnectionError):
+            send_pay_slip_chunk.apply(args=(queued[0],))
+        for chunk_id in queued[1:]:
+            send_pay_slip_chunk.apply(args=(chunk_id,))
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.failed_chunks, run.sent_count), (PaySlipStatus.FAILED, 1, 3))
+
+        run, requeued = self.dispatch()
+        self.assertEqual(requeued, [queued[0]])
+        send_pay_slip_chunk.apply(args=(queued[0],))
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.failed_chunks, run.sent_count), (PaySlipStatus.COMPLETED, 0, 5))
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_chunk_of_a_lost_worker_resumes_from_its_checkpoint(self):
+        run, queued = self.dispatch()
+        # the worker sent the first slip of the chunk then died, leaving the chunk running
+        lost_at = timezone.now() - timedelta(seconds=3600)
+        PaySlipChunk.objects.filter(pk=queued[0]).update(status=PaySlipStatus.RUNNING, attempts=1, sent_count=1,
+                                                         checkpoint=self.teachers[0].id, updated_at=lost_at)
+        for chunk_id in queued[1:]:
+            send_pay_slip_chunk.apply(args=(chunk_id,))
+
+        with override_settings(PAY_SLIP_CHUNK_STALE_AFTER=7200):
+            self.assertEqual(self.dispatch()[1], [])
+        with override_settings(PAY_SLIP_CHUNK_STALE_AFTER=600):
+            run, requeued = self.dispatch()
+            self.assertEqual(requeued, [queued[0]])
+            send_pay_slip_chunk.apply(args=(queued[0],))
+
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.completed_chunks, run.sent_count), (PaySlipStatus.COMPLETED, 3, 5))
+        self.assertNotIn(self.teachers[0].email, [message.to[0] for message in mail.outbox])
+        self.assertEqual(len(mail.outbox), 4)
+
+
+class CycleAnalyticsTestCase(TestCase):
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(ATTENDANCE_ARCHIVE_DIR=archive_dir.name, ATTENDANCE_LATE_AFTER="09:00")
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        today = timezone.localdate()
+        level = Level.objects.create(name="L1", pay_grade=100)
+        self.salary_cycle = SalaryCycle.objects.create(start_date=today - timedelta(days=6), end_date=today,
+                                                       average_work_hour=8)
+        teachers = [Teacher.objects.create(first_name=f"first{i}", last_name="last", email=f"teacher{i}@x.com",
+                                           account_number=f"{i:010d}", level=level) for i in range(4)]
+        for i, teacher in enumerate(teachers):
+            for day in range(i, 8):
+                date = today - timedelta(days=day)
+                clock_in = timezone.make_aware(datetime.combine(date, time(8, 0, i))) + timedelta(minutes=15 * day)
+                # the teacher forgot to clock out every third day, today is still open
+                clock_out = None if (day + i) % 3 == 0 or day == 0 else clock_in + timedelta(hours=day, seconds=i, microseconds=10)
+                Attendance.objects.create(teacher=teacher, date=date, clock_in=clock_in, clock_out=clock_out)
+        teachers[3].soft_delete()
+
+    def test_matches_the_attendance_rows(self):
+        today = timezone.localdate()
+        expected = {}
+        for teacher_id, date, clock_in, clock_out in Attendance.active_objects.filter(
+                teacher__is_deleted=False, date__range=(self.salary_cycle.start_date, self.salary_cycle.end_date)
+        ).values_list("teacher_id", "date", "clock_in", "clock_out"):
+            row = expected.setdefault(teacher_id, {"days_present": 0, "late_count": 0, "missing_clock_outs": 0, "seconds": 0})
+            row["days_present"] += 1
+            row["late_count"] += timezone.localtime(clock_in).time() > time(9)
+            row["missing_clock_outs"] += clock_out is None and date < today
+            row["seconds"] += (clock_out - clock_in) // timedelta(seconds=1) if clock_out else 0
+
+        analytics = cycle_analytics(self.salary_cycle)
+        self.assertEqual(analytics["teachers"], 3)
+        self.assertEqual({item["teacher_id"]: (item["days_present"], item["late_count"], item["missing_clock_outs"],
+                                               item["total_work_hours"]) for item in analytics["items"]},
+                         {teacher_id: (row["days_present"], row["late_count"], row["missing_clock_outs"],
+                                       round(row["seconds"] / 3600, 2)) for teacher_id, row in expected.items()})
+        self.assertEqual(analytics["days_present"], sum(row["days_present"] for row in expected.values()))
+        self.assertEqual(analytics["late_count"], sum(row["late_count"] for row in expected.values()))
+
+
+class LevelChangePayrollTestCase(TestCase):
+    """ a ten day cycle, every teacher works an hour a day """
+
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(ATTENDANCE_ARCHIVE_DIR=archive_dir.name)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.start = timezone.localdate() - timedelta(days=20)
+        self.salary_cycle = SalaryCycle.objects.create(start_date=self.start, end_date=self.start + timedelta(days=9),
+                                                       average_work_hour=8)
+        self.levels = {pay_grade: Level.objects.create(name=f"L{pay_grade}", pay_grade=pay_grade) for pay_grade in (100, 200, 300)}
+        self.teachers = 0
+
+    def teacher(self, pay_grade, *changes):
+        """ a teacher at the level of pay_grade before their changes, (day of the cycle, pay grade) each """
+        self.teachers += 1
+        teacher = Teacher.objects.create(first_name="first", last_name="last", email=f"teacher{self.teachers}@x.com",
+                                         account_number=f"{self.teachers:010d}", level=self.levels[pay_grade])
+        for day in range(10):
+            clock_in = timezone.make_aware(datetime.combine(self.start + timedelta(days=day), time(8)))
+            Attendance.objects.create(teacher=teacher, date=clock_in.date(), clock_in=clock_in,
+                                      clock_out=clock_in + timedelta(hours=1, microseconds=500000))
+        for day, new_pay_grade in changes:
+            self.change(teacher, day, new_pay_grade, previous_level=teacher.level)
+        return teacher
+
+    def change(self, teacher, day, pay_grade, previous_level):
+        PromotionDemotion.objects.create(salary_cycle=self.salary_cycle, teacher=teacher, level=self.levels[pay_grade],
+                                         previous_level=previous_level, effective_date=self.start + timedelta(days=day))
+        teacher.level = self.levels[pay_grade]
+        teacher.save(update_fields=["level"])
+
+    def payroll(self):
+        call_command("rebuild_work_hour_ledger", salary_cycle=self.salary_cycle.id, stdout=io.StringIO())
+        level_changes = get_level_changes(self.salary_cycle)
+        return {row["id"]: (row["level__pay_grade"], row["total_pay"]) for row in (
+            prorate_payroll(row, level_changes) for row in get_teacher_payroll(self.salary_cycle))}
+
+    def assertPaid(self, payroll, teacher, pay_grade, total_pay):
+        self.assertEqual(payroll[teacher.id], (Decimal(pay_grade), Decimal(total_pay)))
+
+    def test_no_change(self):
+        teacher = self.teacher(100)
+        self.assertPaid(self.payroll(), teacher, 100, "1000.00")
+
+    def test_one_change_within_the_cycle(self):
+        teacher = self.teacher(100, (4, 200))
+        self.assertPaid(self.payroll(), teacher, 200, "1600.00")
+
+    def test_two_changes_within_the_cycle(self):
+        teacher = self.teacher(100, (3, 200), (7, 300))
+        self.assertPaid(self.payroll(), teacher, 300, "2000.00")
+
+    def test_changes_outside_the_cycle(self):
+        # before or on the first day, the whole cycle is at the new level. after the last day, at the old one
+        before = self.teacher(100, (-5, 200))
+        first_day = self.teacher(100, (0, 200))
+        after = self.teacher(100, (12, 300))
+        payroll = self.payroll()
+        self.assertPaid(payroll, before, 200, "2000.00")
+        self.assertPaid(payroll, first_day, 200, "2000.00")
+        self.assertPaid(payroll, after, 100, "1000.00")
+
+    def test_deleted_change_is_ignored(self):
+        teacher = self.teacher(100, (4, 200))
+        PromotionDemotion.objects.filter(teacher=teacher).update(is_deleted=True)
+        self.assertPaid(self.payroll(), teacher, 200, "2000.00")
+
+    def test_archived_attendance(self):
+        teachers = [self.teacher(100), self.teacher(100, (4, 200)), self.teacher(100, (3, 200), (7, 300))]
+        payroll = self.payroll()
+        archive_salary_cycle(self.salary_cycle, batch_size=7)
+        self.assertFalse(Attendance.objects.exists())
+        self.assertEqual(self.payroll(), payroll)
+        self.assertPaid(payroll, teachers[1], 200, "1600.00")
+
+    def test_change_with_no_previous_level(self):
+        # recorded before previous levels were, and left unset by backfill_level_changes as it was the first
+        # change of the teacher: the level before it is unknown, the days before it are not paid
+        teacher = self.teacher(100)
+        self.change(teacher, 4, 200, previous_level=None)
+        self.assertPaid(self.payroll(), teacher, 200, "1200.00")
@@ -5,15 +5,16 @@ from django.core.mail import EmailMultiAlternatives
 class EmailSender:
 
     @classmethod
-    def _send_email(cls, subject, mail_content, recipient, from_email):
+    def _send_email(cls, subject, mail_content, recipient, from_email, connection=None):
         msg = EmailMultiAlternatives(
-            subject, mail_content, from_email, [recipient])
+            subject, mail_content, from_email, [recipient], connection=connection)
         msg.attach_alternative(mail_content, "text/html")
         msg.send()
 
     @classmethod
-    def teacher_payment_mail(cls, recipient, mail_body):
+    def teacher_payment_mail(cls, recipient, mail_body, connection=None):
+        """ pass an opened connection to reuse it across many mails """
         subject = "Your Pay Slip Has Arrived"
         from_email = settings.EMAIL_HOST_USER
         return cls._send_email(subject=subject, mail_content=mail_body, recipient=recipient,
-                               from_email=from_email)
+                               from_email=from_email, connection=connection)
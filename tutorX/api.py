@@ -2,6 +2,7 @@ import http
 import traceback
 
 from django.conf import settings
+from django.http import HttpResponse
 
 from ninja import NinjaAPI
 from ninja.errors import AuthenticationError
@@ -12,9 +13,19 @@ from tutorX.parsers import ORJSONParser
 from tutorX.renderers import ORJSONRenderer
 from accounts.auth import async_auth_bearer
 from accounts.exceptions import ExpiredTokenError, EmptyAuthorizationHeader, InvalidToken
+from base.conditional import add_validators
+from base.pagination import InvalidPagination
+from base.executors import ExecutorBusy
+from tutorX.metrics import registry
 
 
-api = NinjaAPI(
+class TutorXAPI(NinjaAPI):
+    def create_response(self, request, data, *, status=None, temporal_response=None):
+        response = super().create_response(request, data, status=status, temporal_response=temporal_response)
+        return add_validators(request, response)
+
+
+api = TutorXAPI(
     title="Tutor X",
     description="Tutor X API",
     parser=ORJSONParser(),
@@ -26,6 +37,15 @@ api.add_router('accounts/', accounts_router)
 api.add_router('payments/', payments_router)
 
 
+@api.get("/metrics", auth=None, include_in_schema=False)
+def metrics(request):
+    """ prometheus metrics of this worker """
+    allowed_ips = settings.METRICS_ALLOWED_IPS
+    if not settings.METRICS_ENABLED or (allowed_ips and request.META.get("REMOTE_ADDR") not in allowed_ips):
+        return HttpResponse(status=http.HTTPStatus.NOT_FOUND)
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 def exception_handler_base(request, exc, msg=None, status=http.HTTPStatus.INTERNAL_SERVER_ERROR):
     return api.create_response(
         request,
@@ -55,6 +75,16 @@ def expired_token_exception_handler(request, exc):
     return exception_handler_base(request, exc, "Session has expired. Please log in again", status=401)
 
 
+@api.exception_handler(InvalidPagination)
+def invalid_pagination_exception_handler(request, exc):
+    return exception_handler_base(request, exc, msg=str(exc), status=http.HTTPStatus.BAD_REQUEST)
+
+
+@api.exception_handler(ExecutorBusy)
+def executor_busy_exception_handler(request, exc):
+    return exception_handler_base(request, exc, msg="Server is busy. Please try again", status=http.HTTPStatus.SERVICE_UNAVAILABLE)
+
+
 @api.exception_handler(Exception)
 def exception_handler(request, exc):
     return exception_handler_base(request, exc)
@@ -0,0 +1,129 @@
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+
+PRIMARY_DB = "default"
+REPLICA_DB = "replica"
+
+
+class RequestRouting:
+    """ what the request being served did, shared with its sync_to_async threads """
+    __slots__ = ("client_key", "wrote", "sticky")
+
+    def __init__(self, client_key):
+        self.client_key = client_key
+        self.wrote = False
+        # looked up on the first replica read only, most requests never need it
+        self.sticky = None
+
+    def is_sticky(self):
+        if self.sticky is None:
+            self.sticky = cache.get(sticky_key(self.client_key)) is not None
+        return self.sticky
+
+    async def ais_sticky(self):
+        if self.sticky is None:
+            self.sticky = await cache.aget(sticky_key(self.client_key)) is not None
+        return self.sticky
+
+
+current_routing = ContextVar("current_routing", default=None)
+replica_reads = ContextVar("replica_reads", default=False)
+
+
+def sticky_key(client_key):
+    return f"db:primary:{client_key}"
+
+
+def client_key(request):
+    """ the caller, by its token when it sends one so clients behind one address are told apart """
+    auth = request.headers.get("Authorization")
+    if auth:
+        return hashlib.sha256(auth.encode()).hexdigest()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+async def aresolve_routing():
+    """ look up what db_for_read needs without blocking the event loop, before routing a read from it """
+    routing = current_routing.get()
+    if routing is not None and replica_reads.get() and REPLICA_DB in settings.DATABASES:
+        await routing.ais_sticky()
+
+
+async def adb_for_read(model):
+    """ the alias reads of the model go to, for reads made once the request is served, e.g. by a streamed response """
+    await aresolve_routing()
+    return router.db_for_read(model)
+
+
+@contextmanager
+def read_from_replica():
+    """ reads made inside go to the replica, unless the caller wrote recently """
+    token = replica_reads.set(True)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    """ reads made inside go to the primary, even inside read_from_replica() """
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+def use_replica(view_func):
+    """ decorator for read-only endpoints and reporting tasks, sync or async """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def wrapper(*args, **kwargs):
+            with read_from_replica():
+                return await view_func(*args, **kwargs)
+    else:
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            with read_from_replica():
+                return view_func(*args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes go to the primary. Reads go to the replica inside read_from_replica() when one is configured,
+    except inside a transaction, after the request wrote, or for DB_STICKY_PRIMARY_SECONDS after
+    an earlier request of the same caller wrote, so callers always read their own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not replica_reads.get() or REPLICA_DB not in settings.DATABASES:
+            return PRIMARY_DB
+        if connections[PRIMARY_DB].in_atomic_block:
+            return PRIMARY_DB
+        routing = current_routing.get()
+        if routing is not None and (routing.wrote or routing.is_sticky()):
+            return PRIMARY_DB
+        return REPLICA_DB
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
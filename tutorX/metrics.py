@@ -0,0 +1,163 @@
+import bisect
+import time
+from contextvars import ContextVar
+from threading import Lock
+
+from base.executors import BoundedExecutor
+from base.signals import thread_hop
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """ sql and worker thread usage of the request being served. the threads of a request may add to it at once """
+    __slots__ = ("sql_count", "sql_seconds", "sync_calls", "sync_seconds", "_lock")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.sync_calls = 0
+        self.sync_seconds = 0.0
+        self._lock = Lock()
+
+    def add_sql(self, seconds):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+
+    def add_sync(self, seconds):
+        with self._lock:
+            self.sync_calls += 1
+            self.sync_seconds += seconds
+
+
+# contextvars are copied into the worker threads, so queries run there are counted for the request too
+current_request_stats = ContextVar("current_request_stats", default=None)
+
+
+class RouteMetrics:
+    __slots__ = ("buckets", "latency_sum", "count", "statuses", "sql_count", "sql_seconds", "sync_calls", "sync_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.count = 0
+        self.statuses = {}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.sync_calls = 0
+        self.sync_seconds = 0.0
+
+
+class MetricsRegistry:
+    """ per route metrics of this process, rendered in the prometheus text format """
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = Lock()
+
+    def observe(self, method, route, status, seconds, stats):
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics()
+            metrics.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            metrics.latency_sum += seconds
+            metrics.count += 1
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.sql_count += stats.sql_count
+            metrics.sql_seconds += stats.sql_seconds
+            metrics.sync_calls += stats.sync_calls
+            metrics.sync_seconds += stats.sync_seconds
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                "# HELP tutorx_http_request_duration_seconds Request latency by route.",
+                "# TYPE tutorx_http_request_duration_seconds histogram",
+            ]
+            for (method, route), metrics in routes:
+                labels = _labels(method=method, route=route)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), metrics.buckets):
+                    cumulative += count
+                    lines.append(f'tutorx_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"tutorx_http_request_duration_seconds_sum{{{labels}}} {metrics.latency_sum}")
+                lines.append(f"tutorx_http_request_duration_seconds_count{{{labels}}} {metrics.count}")
+
+            lines += ["# HELP tutorx_http_responses_total Responses by route and status code.",
+                      "# TYPE tutorx_http_responses_total counter"]
+            for (method, route), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f"tutorx_http_responses_total{{{_labels(method=method, route=route, status=status)}}} {count}")
+
+            for name, attribute, help_text in (
+                ("tutorx_db_queries_total", "sql_count", "SQL queries run by route."),
+                ("tutorx_db_query_seconds_total", "sql_seconds", "Time spent running SQL by route."),
+                ("tutorx_sync_to_async_calls_total", "sync_calls", "ORM and executor thread hops by route."),
+                ("tutorx_sync_to_async_seconds_total", "sync_seconds", "Time spent awaiting thread hops by route."),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (method, route), metrics in routes:
+                    lines.append(f"{name}{{{_labels(method=method, route=route)}}} {getattr(metrics, attribute)}")
+
+        lines += _render_executors()
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+
+def _render_executors():
+    lines = []
+    for name, help_text, type_, key in (
+        ("tutorx_executor_pending", "Jobs running or waiting for a worker.", "gauge", "pending"),
+        ("tutorx_executor_jobs_total", "Jobs started.", "counter", "jobs"),
+        ("tutorx_executor_queue_wait_seconds_total", "Time jobs waited for a worker.", "counter", "wait_seconds"),
+        ("tutorx_executor_queue_wait_seconds_max", "Longest time a job waited for a worker.", "gauge", "max_wait_seconds"),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {type_}"]
+        for executor in BoundedExecutor.instances:
+            lines.append(f"{name}{{{_labels(executor=executor.name)}}} {executor.stats()[key]}")
+    return lines
+
+
+registry = MetricsRegistry()
+
+
+def sql_execute_wrapper(execute, sql, params, many, context):
+    stats = current_request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_sql(time.perf_counter() - started_at)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    """ connection_created receiver counting the queries of every connection, whatever thread opened it """
+    if sql_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_execute_wrapper)
+
+
+def record_thread_hop(sender, seconds, **kwargs):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.add_sync(seconds)
+
+
+def install():
+    """ count the queries of every connection and time the hops to the ORM and executor threads """
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(install_sql_wrapper, dispatch_uid="tutorx_metrics_sql_wrapper")
+    for connection in connections.all(initialized_only=True):
+        install_sql_wrapper(sender=None, connection=connection)
+    thread_hop.connect(record_thread_hop, dispatch_uid="tutorx_metrics_thread_hop")
@@ -0,0 +1,93 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+
+from tutorX import db_router, metrics
+
+
+class MetricsMiddleware:
+    """ records latency, status, sql and worker thread usage of every request per route """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = settings.METRICS_ENABLED
+        if self.enabled:
+            metrics.install()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = metrics.RequestStats()
+        token = metrics.current_request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request_stats.reset(token)
+        self._observe(request, response, time.perf_counter() - started_at, stats)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        stats = metrics.RequestStats()
+        token = metrics.current_request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request_stats.reset(token)
+        self._observe(request, response, time.perf_counter() - started_at, stats)
+        return response
+
+    def _observe(self, request, response, seconds, stats):
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        metrics.registry.observe(request.method, route, response.status_code, seconds, stats)
+
+
+class DatabaseRoutingMiddleware:
+    """ tracks the writes of every request so its caller keeps reading from the primary for a while after """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        routing = db_router.RequestRouting(db_router.client_key(request))
+        token = db_router.current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.current_routing.reset(token)
+        if routing.wrote:
+            cache.set(db_router.sticky_key(routing.client_key), 1, timeout=settings.DB_STICKY_PRIMARY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        routing = db_router.RequestRouting(db_router.client_key(request))
+        token = db_router.current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            db_router.current_routing.reset(token)
+        if routing.wrote:
+            await cache.aset(db_router.sticky_key(routing.client_key), 1, timeout=settings.DB_STICKY_PRIMARY_SECONDS)
+        return response
@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tutorX.middleware.MetricsMiddleware',
+    'tutorX.middleware.DatabaseRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,10 +89,35 @@ DATABASES = {
         'USER': config("DB_USERNAME", default=""),
         'PASSWORD': config("DB_PASSWORD", default=""),
         'HOST': config("DB_HOST", default='localhost'),
-        'PORT': config("DB_PORT", default="")
+        'PORT': config("DB_PORT", default=""),
+        # connections are kept for CONN_MAX_AGE seconds by the thread that opened them and checked
+        # before being reused. under ASGI every request runs on a new thread that never reuses its
+        # connection, so keep it at 0 there and use ORM_EXECUTOR_ENABLED, whose threads keep theirs
+        'CONN_MAX_AGE': config("DB_CONN_MAX_AGE", default=0, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# read-only endpoints and reporting tasks read from the replica when DB_REPLICA_NAME is set
+DB_REPLICA_NAME = config("DB_REPLICA_NAME", default="")
+if DB_REPLICA_NAME:
+    DATABASES["replica"] = {
+        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'NAME': DB_REPLICA_NAME,
+        'USER': config("DB_REPLICA_USERNAME", default=DATABASES["default"]["USER"]),
+        'PASSWORD': config("DB_REPLICA_PASSWORD", default=DATABASES["default"]["PASSWORD"]),
+        'HOST': config("DB_REPLICA_HOST", default=DATABASES["default"]["HOST"]),
+        'PORT': config("DB_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+        'CONN_MAX_AGE': DATABASES["default"]["CONN_MAX_AGE"],
+        'CONN_HEALTH_CHECKS': True,
+        # tests read the replica through the default connection
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ["tutorX.db_router.PrimaryReplicaRouter"]
+# seconds a caller keeps reading from the primary after one of its requests wrote
+DB_STICKY_PRIMARY_SECONDS = config("DB_STICKY_PRIMARY_SECONDS", default=10, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -128,11 +155,21 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# shared by every worker, holds the versions and rows of the cached reference data
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": config("CACHE_URL", default="redis://127.0.0.1:6379/1"),
+    }
+}
+
 # celery
 CELERY_BROKER_URL = config("CELERY_BROKER", default="redis://127.0.0.1:6379")
 # CELERY_RESULT_BACKEND = config("CELERY_BACKEND", default="redis://redis:6379")
@@ -148,6 +185,45 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_TIMEZONE = "Africa/Lagos"
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
+# pay slips are sent in chunks of teachers, each chunk over one mail connection
+PAY_SLIP_CHUNK_SIZE = config("PAY_SLIP_CHUNK_SIZE", default=200, cast=int)
+PAY_SLIP_CHUNK_MAX_RETRIES = config("PAY_SLIP_CHUNK_MAX_RETRIES", default=5, cast=int)
+PAY_SLIP_CHUNK_RETRY_DELAY = config("PAY_SLIP_CHUNK_RETRY_DELAY", default=30, cast=int)
+# seconds without progress after which a running chunk is taken to be held by a lost worker and is sent again
+PAY_SLIP_CHUNK_STALE_AFTER = config("PAY_SLIP_CHUNK_STALE_AFTER", default=600, cast=int)
+
+# payroll rows read from the database cursor, and written to the csv export, at a time
+PAYROLL_EXPORT_CHUNK_SIZE = config("PAYROLL_EXPORT_CHUNK_SIZE", default=2000, cast=int)
+
+# rendered pay slips are archived by salary cycle, teacher and content hash
+SLIP_ARCHIVE_DIR = config("SLIP_ARCHIVE_DIR", default=str(MEDIA_ROOT / "slips"))
+
+# teacher csv uploads larger than the threshold (bytes) are imported by a worker
+TEACHER_IMPORT_ASYNC_THRESHOLD = config("TEACHER_IMPORT_ASYNC_THRESHOLD", default=1024 * 1024, cast=int)
+TEACHER_IMPORT_BATCH_SIZE = config("TEACHER_IMPORT_BATCH_SIZE", default=1000, cast=int)
+
+# seconds a worker trusts its in-memory salary cycles and levels before checking the shared version
+SALARY_CYCLE_INDEX_CHECK_INTERVAL = config("SALARY_CYCLE_INDEX_CHECK_INTERVAL", default=5, cast=float)
+LEVEL_CACHE_CHECK_INTERVAL = config("LEVEL_CACHE_CHECK_INTERVAL", default=5, cast=float)
+# seconds the rows of each version of the reference data are kept in the shared cache
+REFERENCE_DATA_CACHE_TIMEOUT = config("REFERENCE_DATA_CACHE_TIMEOUT", default=24 * 60 * 60, cast=int)
+
+# clock events a device can send in one batch, and how far ahead of the server clock their time may be (seconds)
+ATTENDANCE_BATCH_MAX_EVENTS = config("ATTENDANCE_BATCH_MAX_EVENTS", default=1000, cast=int)
+ATTENDANCE_MAX_CLOCK_SKEW = config("ATTENDANCE_MAX_CLOCK_SKEW", default=300, cast=int)
+# weekdays teachers are expected at work (0 = monday) and the local time after which a clock-in is late
+ATTENDANCE_WORK_WEEKDAYS = config("ATTENDANCE_WORK_WEEKDAYS", default="0,1,2,3,4",
+                                  cast=lambda v: [int(day) for day in v.split(",") if day.strip()])
+ATTENDANCE_LATE_AFTER = config("ATTENDANCE_LATE_AFTER", default="09:00")
+# attendance of salary cycles ended more than the retention (days) ago is moved to compressed files, a cycle per file
+ATTENDANCE_ARCHIVE_DIR = config("ATTENDANCE_ARCHIVE_DIR", default=str(MEDIA_ROOT / "attendance"))
+ATTENDANCE_ARCHIVE_RETENTION_DAYS = config("ATTENDANCE_ARCHIVE_RETENTION_DAYS", default=365, cast=int)
+ATTENDANCE_ARCHIVE_BATCH_SIZE = config("ATTENDANCE_ARCHIVE_BATCH_SIZE", default=5000, cast=int)
+ATTENDANCE_ARCHIVE_COMPRESSION = config("ATTENDANCE_ARCHIVE_COMPRESSION", default=6, cast=int)
+
+# number of teacher emails kept in memory by each worker for attendance
+TEACHER_ID_CACHE_SIZE = config("TEACHER_ID_CACHE_SIZE", default=10000, cast=int)
+
 
 JWT_SALT = config('JWT_SALT', cast=str)
 
@@ -160,6 +236,42 @@ JWT = {
     "AUDIENCE": None,
 }
 
+# verified access tokens are cached per worker for at most TOKEN_CACHE_TTL seconds
+TOKEN_CACHE_SIZE = config("TOKEN_CACHE_SIZE", default=10000, cast=int)
+TOKEN_CACHE_TTL = config("TOKEN_CACHE_TTL", default=300, cast=int)
+# seconds a worker trusts the token version of a user before reading it again, revoked tokens last at most that long
+TOKEN_CACHE_CHECK_INTERVAL = config("TOKEN_CACHE_CHECK_INTERVAL", default=5, cast=float)
+
+# threads hashing passwords on login and how many logins may wait for them before answering 503
+PASSWORD_HASHER_WORKERS = config("PASSWORD_HASHER_WORKERS", default=2, cast=int)
+PASSWORD_HASHER_MAX_QUEUE = config("PASSWORD_HASHER_MAX_QUEUE", default=64, cast=int)
+
+# run the ORM calls of async views in parallel on a pool of threads, each with its own connection,
+# instead of one at a time on the thread sensitive thread. keep workers under the database connection limit
+ORM_EXECUTOR_ENABLED = config("ORM_EXECUTOR_ENABLED", default=False, cast=bool)
+ORM_EXECUTOR_WORKERS = config("ORM_EXECUTOR_WORKERS", default=8, cast=int)
+ORM_EXECUTOR_MAX_QUEUE = config("ORM_EXECUTOR_MAX_QUEUE", default=256, cast=int)
+ORM_EXECUTOR_CONN_MAX_AGE = config("ORM_EXECUTOR_CONN_MAX_AGE", default=60, cast=int)
+
+# lookups by key asked for within DATALOADER_WINDOW seconds (0 = the same event loop tick) share one query
+DATALOADER_WINDOW = config("DATALOADER_WINDOW", default=0, cast=float)
+DATALOADER_MAX_BATCH_SIZE = config("DATALOADER_MAX_BATCH_SIZE", default=500, cast=int)
+
+# rows soft deleted more than PURGE_DELETED_AFTER_DAYS ago are hard deleted by purge_deleted, a batch per transaction
+PURGE_DELETED_AFTER_DAYS = config("PURGE_DELETED_AFTER_DAYS", default=30, cast=int)
+PURGE_BATCH_SIZE = config("PURGE_BATCH_SIZE", default=1000, cast=int)
+
+# seconds clients may reuse a response of a conditional GET endpoint without revalidating it. 0 = always revalidate
+CONDITIONAL_GET_MAX_AGE = config("CONDITIONAL_GET_MAX_AGE", default=0, cast=int)
+
+# list endpoints serialize the rows they read with .values() of their schema fields without validating them again
+TRUSTED_RESPONSES_ENABLED = config("TRUSTED_RESPONSES_ENABLED", default=True, cast=bool)
+
+# per route metrics served in the prometheus format at /api/metrics
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+# comma separated addresses allowed to read /api/metrics. anyone when empty
+METRICS_ALLOWED_IPS = config("METRICS_ALLOWED_IPS", default="", cast=lambda v: [ip.strip() for ip in v.split(",") if ip.strip()])
+
 # Email Credentials
 SERVER_EMAIL = config('SERVER_EMAIL', default="")
 EMAIL_USE_TLS = True